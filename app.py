@@ -1,15 +1,28 @@
+import asyncio
+import json
+import time
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import yaml
 
-from utils.pds_utils import pdf_to_images
-from utils.viz_utils import draw_boxes
-from utils.json_utils import build_results_dict
+from main_infer import process_pdf
+from utils.pds_utils import PdfReadError, RenderPool, pdf_page_count
+from utils.json_utils import build_annotation, build_doc_entry, page_size_entry
+from utils.cache_utils import build_detection_cache
+from utils.dedup_utils import build_dedup_index
+from utils.metrics_utils import server_timing_header
+from utils.timing_utils import StageTimer
+from utils.viz_utils import VIZ_FORMATS
 from src.detectors.ensemble import EnsembleDetector
+from src.service.jobs import Job, JobManager, QueueFullError
+from src.service.scheduler import InferenceScheduler
+from src.service.metrics import ServiceMetrics, route_path
+from src.service.viz import PageVizRenderer
+from src.service.scratch import RequestSizeLimit, ScratchQuotaError, ScratchSpace, UploadTooLargeError
 
 app = FastAPI(title="Digital Inspector API")
 
@@ -32,42 +45,359 @@ CFG_PATH = Path("config/config.yaml")
 with open(CFG_PATH, "r", encoding="utf-8") as f:
     CFG = yaml.safe_load(f)
 
-ENSEMBLE = EnsembleDetector(CFG)
+API_CFG = CFG.get("api", {})
+# загрузки и страницы задач живут в папке задачи, она удаляется вместе с задачей
+SCRATCH = ScratchSpace(
+    API_CFG.get("tmp_dir", "data/tmp_api"),
+    quota_mb=API_CFG.get("scratch_quota_mb"),
+    max_upload_mb=API_CFG.get("max_upload_mb"),
+    chunk_size=API_CFG.get("upload_chunk_kb", 1024) * 1024,
+)
+STREAM_POLL_SEC = API_CFG.get("stream_poll_ms", 100) / 1000.0
 
+# тело запроса ограничено до того, как Starlette начнёт спулить его на диск
+_max_request_mb = API_CFG.get("max_request_mb") or API_CFG.get("scratch_quota_mb")
+app.add_middleware(RequestSizeLimit, max_bytes=int(_max_request_mb * 1024 * 1024) if _max_request_mb else None)
+
+# потоковая выдача результатов: формат -> media type
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+METRICS = ServiceMetrics()
+
+# стадии ансамбля (predict.<модель>, crop_pass, nms, ...) сразу уходят в метрики, не копясь в памяти
+ENSEMBLE_TIMER = StageTimer(keep_samples=False)
+ENSEMBLE_TIMER.add_observer(METRICS.observe_stage)
+ENSEMBLE = EnsembleDetector(
+    CFG, cache=build_detection_cache(CFG), timer=ENSEMBLE_TIMER, dedup=build_dedup_index(CFG)
+)
+
+# все задачи отдают страницы в общий планировщик, он собирает их в пачки
+SCHEDULER_CFG = API_CFG.get("scheduler", {})
+SCHEDULER = InferenceScheduler(
+    ENSEMBLE,
+    max_batch_size=SCHEDULER_CFG.get("max_batch_size", 8),
+    max_wait_ms=SCHEDULER_CFG.get("max_wait_ms", 5),
+)
+
+# большой PDF растеризуется диапазонами страниц в нескольких процессах,
+# детекция идёт через тот же планировщик
+RENDER_WORKERS = API_CFG.get("render_workers", 1)
+RENDER_POOL = (
+    RenderPool(RENDER_WORKERS, chunk_pages=API_CFG.get("render_chunk_pages", 4))
+    if RENDER_WORKERS > 1
+    else None
+)
+
+# картинки с боксами рисуются только по запросу, а не для каждой страницы каждой задачи
+VIZ_TIMER = StageTimer(keep_samples=False)
+VIZ_TIMER.add_observer(METRICS.observe_stage)
+VIZ = PageVizRenderer(CFG, max_pages=API_CFG.get("viz_cache_pages", 16), timer=VIZ_TIMER)
+
+
+def _on_page_done(job: Job, doc_name: str, page_num: int, page_info: dict) -> None:
+    job.page_done(doc_name)
+    # аннотации страницы без номеров: страницы готовы не по порядку,
+    # нумерация annotation_N — в событии document
+    event = {
+        "event": "page",
+        "document": doc_name,
+        "page": page_num,
+        "page_size": page_size_entry(page_info),
+        "annotations": [build_annotation(det) for det in page_info["detections"]],
+    }
+    if "dedup_of" in page_info:
+        # индекс dedup общий для всех клиентов: источник («документ:страница»)
+        # может быть чужой загрузкой — наружу только расстояние
+        event["dedup_of"] = {"distance": page_info["dedup_of"]["distance"]}
+    job.publish(event)
+
+
+def run_job(job: Job) -> dict:
+    """Выполняется в пуле JobManager, а не в event loop."""
+    # свой таймер на задачу: разбивка по стадиям для Server-Timing / debug
+    timer = StageTimer()
+    timer.add_observer(METRICS.observe_stage)
+    # страницы (если render.save_page_images) — в папку задачи, а не в общий paths.page_images
+    cfg = {**CFG, "paths": {**CFG["paths"], "page_images": str(Path(job.workdir) / "pages")}}
+    result = {}
+    try:
+        for doc_name, pdf_path in job.files:
+            try:
+                pages_total = pdf_page_count(pdf_path)
+            except PdfReadError as exc:
+                # в ошибке — имя документа от клиента, а не uuid-файл в рабочей папке
+                raise PdfReadError(f"{doc_name}: {exc}") from exc
+            job.set_total(doc_name, pages_total)
+            job.predictions[doc_name] = process_pdf(
+                pdf_path,
+                cfg,
+                SCHEDULER,
+                on_page=lambda page_num, page_info, name=doc_name: _on_page_done(job, name, page_num, page_info),
+                timer=timer,
+                viz_mode="none",
+                render_pool=RENDER_POOL,
+                doc_name=doc_name,
+            )
+
+            # документ в схеме итогового JSON (как build_results_dict)
+            doc_entry = build_doc_entry(job.predictions[doc_name])
+            job.publish({"event": "document", "document": doc_name, "result": doc_entry})
+            if doc_entry:
+                result[doc_name] = doc_entry
+    finally:
+        job.timings = timer.summary()
+
+    return result
+
+
+def record_job_metrics(job: Job) -> None:
+    pages = sum(p["pages_done"] for p in job.to_dict()["progress"].values())
+    METRICS.observe_job(job.status, job.finished_at - job.started_at, pages)
+
+
+def release_job_files(job: Job) -> None:
+    for _, pdf_path in job.files:
+        VIZ.forget(pdf_path)
+    if job.workdir is not None:
+        SCRATCH.remove(Path(job.workdir))
+
+
+JOBS = JobManager(
+    run_job,
+    max_workers=API_CFG.get("max_workers", 1),
+    max_queue=API_CFG.get("max_queue", 16),
+    job_ttl_sec=API_CFG.get("job_ttl_sec", 3600),
+    on_finish=record_job_metrics,
+    on_evict=release_job_files,
+)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    METRICS.observe_request(
+        request.method,
+        route_path(request) or "unmatched",
+        response.status_code,
+        time.perf_counter() - start,
+    )
+    return response
 
-@app.post("/inspect_pdf")
-async def inspect_pdf(file: List[UploadFile] = File(...)):
-    tmp_dir = Path("data/tmp_api")
-    tmp_dir.mkdir(parents=True, exist_ok=True)
 
-    all_docs_predictions = {}
+@app.on_event("shutdown")
+def release_models():
+    JOBS.shutdown()
+    SCHEDULER.close()
+    ENSEMBLE.close()
+    if RENDER_POOL is not None:
+        RENDER_POOL.close()
 
-    for file in file:
-        pdf_path = tmp_dir / file.filename
 
-        content = await file.read()
-        pdf_path.write_bytes(content)
+async def _submit_job(files: List[UploadFile]) -> Job:
+    # заодно освобождаем папки задач, чей результат уже никто не заберёт
+    JOBS.evict_expired()
+    if JOBS.pending() >= JOBS.max_workers + JOBS.max_queue:
+        raise HTTPException(status_code=429, detail="Job queue is full, retry later")
 
-        pages_info = pdf_to_images(str(pdf_path), CFG["paths"]["page_images"])
+    # у каждой задачи своя папка, файлы в ней — с uuid-именами:
+    # одинаковые имена от клиентов не перетирают друг друга
+    job_dir = SCRATCH.create()
+    try:
+        saved = []
+        for upload in files:
+            pdf_path = await SCRATCH.save_upload(upload, job_dir)
+            saved.append((upload.filename, str(pdf_path)))
+        return JOBS.submit(saved, workdir=str(job_dir))
+    except UploadTooLargeError as exc:
+        SCRATCH.remove(job_dir)
+        raise HTTPException(status_code=413, detail=str(exc))
+    except ScratchQuotaError as exc:
+        SCRATCH.remove(job_dir)
+        raise HTTPException(status_code=507, detail=str(exc))
+    except QueueFullError as exc:
+        SCRATCH.remove(job_dir)
+        raise HTTPException(status_code=429, detail=str(exc))
+    except BaseException:
+        SCRATCH.remove(job_dir)
+        raise
 
-        all_docs_predictions[file.filename] = {}
 
-        for page_num, info in pages_info.items():
-            img_path = info["image_path"]
-            width = info["width"]
-            height = info["height"]
+def _format_event(event: dict, fmt: str) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
 
-            detections = ENSEMBLE.detect_on_image(img_path)
 
-            all_docs_predictions[file.filename][page_num] = {
-                "size": (width, height),
-                "detections": detections,
-            }
+async def _stream_events(job: Job, fmt: str):
+    yield _format_event({"event": "job", "job_id": job.id, "documents": [name for name, _ in job.files]}, fmt)
+    index = 0
+    while True:
+        events = job.events_since(index)
+        index += len(events)
+        for event in events:
+            yield _format_event(event, fmt)
+            if event["event"] in ("done", "failed"):
+                return
+        if not events:
+            await asyncio.sleep(STREAM_POLL_SEC)
 
-            viz_name = f"{Path(file.filename).stem}_page_{page_num:04d}_viz.png"
-            viz_path = Path(CFG["paths"]["output_viz"]) / viz_name
-            draw_boxes(img_path, detections, str(viz_path))
 
-    result_dict = build_results_dict(all_docs_predictions)
+def _check_stream_format(fmt: str) -> None:
+    if fmt not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"stream format must be one of {', '.join(STREAM_FORMATS)}")
+
+
+def _event_stream_response(job: Job, fmt: str, release: bool = False) -> StreamingResponse:
+    """release — задача синхронного запроса: после конца потока (или обрыва) она не нужна."""
+    events = _stream_events(job, fmt)
+    if release:
+        events = _released_after(events, job)
+    # no-cache / X-Accel-Buffering — чтобы прокси не копил поток до конца
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events, media_type=STREAM_FORMATS[fmt], headers=headers)
+
+
+async def _released_after(events, job: Job):
+    try:
+        async for chunk in events:
+            yield chunk
+    finally:
+        JOBS.release(job)
+
+
+def _job_error(job: Job, exc: Exception) -> HTTPException:
+    """Ошибка задачи -> HTTP-ответ с JSON: 422 — файл не читается как PDF, иначе 500."""
+    status = 422 if isinstance(exc, PdfReadError) else 500
+    return HTTPException(status_code=status, detail={"job_id": job.id, "error": job.error})
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: List[UploadFile] = File(...)):
+    job = await _submit_job(file)
+    return job.to_dict()
+
+
+def _timing_headers(job: Job) -> dict:
+    return {"Server-Timing": server_timing_header(job.timings)} if job.timings else {}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, debug: bool = False):
+    """debug=true — в ответе ещё и разбивка времени задачи по стадиям (timings)."""
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=job.to_dict(include_timings=debug), headers=_timing_headers(job))
+
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, format: str = "ndjson"):
+    """
+    Результаты задачи по мере готовности: события job, page (аннотации страницы),
+    document (документ в схеме итогового JSON), в конце done или failed.
+    format — ndjson (строка JSON на событие) или sse (server-sent events).
+    Уже случившиеся события отдаются с начала.
+    """
+    _check_stream_format(format)
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _event_stream_response(job, format)
+
+
+@app.get("/jobs/{job_id}/pages/{doc_name}/{page_num}/viz")
+def get_page_viz(
+    job_id: str,
+    doc_name: str,
+    page_num: int,
+    format: Optional[str] = None,
+    quality: Optional[int] = Query(None, ge=1, le=100),
+    max_side: Optional[int] = Query(None, ge=1),
+):
+    """
+    Страница с нарисованными детекциями (page_num с 1).
+    format — png | jpg | webp, quality — для jpg / webp, max_side — уменьшить
+    до этой длинной стороны; незаданное берётся из секции viz конфига.
+    Обычная (не async) функция: рендер и кодирование идут в пуле потоков FastAPI.
+    """
+    if format is not None and format not in VIZ_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {', '.join(VIZ_FORMATS)}")
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    pdf_path = dict(job.files).get(doc_name)
+    if pdf_path is None:
+        raise HTTPException(status_code=404, detail="Document not found in job")
+
+    doc_pred = job.predictions.get(doc_name)
+    if doc_pred is None:
+        raise HTTPException(status_code=409, detail="Document is not processed yet")
+    page_pred = doc_pred.get(page_num)
+    if page_pred is None:
+        raise HTTPException(status_code=404, detail="Page not found")
+
+    content, media_type = VIZ.render(
+        pdf_path, page_num, page_pred["detections"], fmt=format, quality=quality, max_side=max_side
+    )
+    return Response(content=content, media_type=media_type)
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "jobs_pending": JOBS.pending(),
+        "scratch": SCRATCH.stats(),
+        "scheduler": SCHEDULER.stats(),
+        "cache": ENSEMBLE.cache.stats() if ENSEMBLE.cache is not None else None,
+        "triage": ENSEMBLE.triage.stats() if ENSEMBLE.triage is not None else None,
+        "dedup": ENSEMBLE.dedup.stats() if ENSEMBLE.dedup is not None else None,
+        "cascade": ENSEMBLE.cascade.stats() if ENSEMBLE.cascade is not None else None,
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus."""
+    METRICS.refresh(
+        JOBS,
+        SCHEDULER,
+        cache=ENSEMBLE.cache,
+        triage=ENSEMBLE.triage,
+        scratch=SCRATCH,
+        dedup=ENSEMBLE.dedup,
+        cascade=ENSEMBLE.cascade,
+    )
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/inspect_pdf")
+async def inspect_pdf(
+    file: List[UploadFile] = File(...),
+    debug: bool = False,
+    stream: Optional[str] = None,
+):
+    # синхронный для клиента вариант: та же очередь задач, но ждём результат;
+    # stream=ndjson | sse — вместо одного ответа в конце события по страницам (как /jobs/{id}/events)
+    if stream is not None:
+        _check_stream_format(stream)
+    job = await _submit_job(file)
+    if stream is not None:
+        return _event_stream_response(job, stream, release=True)
+
+    # ответ уходит целиком сейчас — загрузки задачи не ждут job_ttl_sec
+    try:
+        result_dict = await asyncio.wrap_future(job.future)
+    except Exception as exc:
+        raise _job_error(job, exc)
+    finally:
+        JOBS.release(job)
 
-    return JSONResponse(content=result_dict)
\ No newline at end of file
+    # разбивка по стадиям — всегда в Server-Timing, в теле только при debug=true
+    if debug:
+        result_dict = {**result_dict, "_debug": {"job_id": job.id, "timings": job.timings}}
+    return JSONResponse(content=result_dict, headers=_timing_headers(job))
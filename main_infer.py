@@ -1,11 +1,31 @@
 import argparse
+import multiprocessing as mp
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
 import yaml
 
-from utils.pds_utils import pdf_to_images
-from utils.viz_utils import draw_boxes
-from utils.json_utils import save_results_json
+from utils.pds_utils import (
+    RenderPool,
+    iter_batches,
+    iter_pdf_pages,
+    page_images_dir,
+    page_tiles,
+    pdf_page_count,
+    render_options,
+    tiling_options,
+    split_page_range,
+)
+from utils.viz_utils import VIZ_FORMATS, VIZ_MODES, draw_boxes, viz_options
+from utils.json_utils import StreamingResultsWriter
+from utils.pipeline_utils import run_page_pipeline
+from utils.cache_utils import build_detection_cache
+from utils.dedup_utils import build_dedup_index
+from utils.manifest_utils import RunManifest, run_fingerprint
+from utils.timing_utils import NULL_TIMER, StageTimer, format_stage_summary
 from src.detectors.ensemble import EnsembleDetector
 
 
@@ -14,34 +34,324 @@ def load_config(cfg_path: str):
         return yaml.safe_load(f)
 
 
-def process_pdf(pdf_path: str, cfg) -> dict:
+def process_pdf(
+    pdf_path: str,
+    cfg,
+    ensemble: EnsembleDetector,
+    on_page: Optional[Callable[[int, dict], None]] = None,
+    timer=NULL_TIMER,
+    viz_mode: Optional[str] = None,
+    page_range: Optional[Tuple[int, int]] = None,
+    render_pool: Optional[RenderPool] = None,
+    doc_name: Optional[str] = None,
+) -> dict:
+    """
+    Рендер + детекция + визуализация одного PDF.
+    ensemble — EnsembleDetector или любой объект с тем же detect_on_pages
+    (например, InferenceScheduler в API).
+    on_page(page_num, {"size", "detections"}) вызывается после каждой обработанной
+    страницы (прогресс и потоковая выдача в API; из потоков viz, порядок не гарантирован).
+    timer — StageTimer для стадий рендера и визуализации (детекцию меряет сам ансамбль).
+    viz_mode — all | detections-only | none (None — viz.mode из конфига).
+    page_range — (первая, последняя) страница с 1: обработать только этот диапазон
+    (шард документа в run_documents); номера страниц остаются сквозными.
+    render_pool — RenderPool: страницы растеризуются параллельно несколькими процессами.
+    doc_name — имя документа для провенанса dedup (по умолчанию — имя файла).
+    Большие листы при tiling.enabled получают PageTiles и детектятся по тайлам.
+    """
     paths_cfg = cfg["paths"]
-    page_images_dir = paths_cfg["page_images"]
     viz_dir = paths_cfg["output_viz"]
+    viz_cfg = viz_options(cfg)
+    if viz_mode is not None:
+        viz_cfg["mode"] = viz_mode
+    viz_ext = VIZ_FORMATS[viz_cfg["format"]][0]
+    pipeline_cfg = cfg.get("pipeline", {})
 
-    pages_info = pdf_to_images(pdf_path, page_images_dir)
-    ensemble = EnsembleDetector(cfg)
+    batch_size = cfg["inference"].get("batch_size", 1)
 
     doc_predictions = {}
 
-    for page_num, info in pages_info.items():
-        img_path = info["image_path"]
-        width = info["width"]
-        height = info["height"]
+    def detect(batch):
+        # с точки зрения документа: включает ожидание планировщика / блокировки ансамбля
+        with timer.stage("detect", pages=len(batch)):
+            return ensemble.detect_on_pages(batch, batch_size=batch_size)
+
+    def write(page, detections):
+        page_num = page.page_num
+
+        # сохраним для JSON (в координатах страницы, даже если детектили по родному скану)
+        page_info = {
+            "size": (page.width, page.height),
+            "detections": page.to_page_coords(detections),
+        }
+        if page.dedup_of is not None:
+            # детекции взяты у почти такой же страницы (dedup) — помним, у какой
+            page_info["dedup_of"] = page.dedup_of
+        doc_predictions[page_num] = page_info
+
+        # визуализация — поверх той картинки, на которой детектили
+        if viz_cfg["mode"] == "all" or (viz_cfg["mode"] == "detections-only" and detections):
+            out_viz_path = Path(viz_dir) / f"{Path(pdf_path).stem}_page_{page_num:04d}_viz{viz_ext}"
+            with timer.stage("viz"):
+                draw_boxes(
+                    page.image,
+                    detections,
+                    str(out_viz_path),
+                    max_side=viz_cfg["max_side"],
+                    quality=viz_cfg["quality"],
+                )
+
+        if on_page is not None:
+            on_page(page_num, page_info)
+
+    # страницы рендерятся в память; PNG пишется только если render.save_page_images,
+    # сканы при render.embedded_images декодируются напрямую
+    if render_pool is not None and page_range is None:
+        pages = render_pool.iter_pages(pdf_path, page_images_dir(cfg), timer=timer, **render_options(cfg))
+    else:
+        pages = iter_pdf_pages(
+            pdf_path, page_images_dir(cfg), timer=timer, page_range=page_range, **render_options(cfg)
+        )
+
+    tiling = tiling_options(cfg)
+    render_dpi = render_options(cfg)["dpi"]
+
+    def labelled(pages):
+        for page in pages:
+            page.doc_name = doc_name or Path(pdf_path).name
+            # тайлы рендерятся лениво, уже в ансамбле (PageTiles)
+            page.tiles = page_tiles(pdf_path, page, render_dpi, tiling)
+            yield page
+
+    pages = labelled(pages)
+
+    if pipeline_cfg.get("enabled", True):
+        # рендер -> детекция -> viz идут параллельно через ограниченные очереди
+        run_page_pipeline(
+            pages,
+            detect,
+            write,
+            batch_size=batch_size,
+            render_queue=pipeline_cfg.get("render_queue", 8),
+            sink_queue=pipeline_cfg.get("sink_queue", 16),
+            sink_workers=pipeline_cfg.get("viz_workers", 2),
+        )
+    else:
+        for batch in iter_batches(pages, batch_size):
+            for page, detections in zip(batch, detect(batch)):
+                write(page, detections)
+
+    # viz-потоки пишут вперемешку — возвращаем страницы по порядку (нумерация аннотаций)
+    return dict(sorted(doc_predictions.items()))
+
+
+# состояние процесса-воркера для --workers N: модели грузятся один раз при старте воркера
+_WORKER_STATE = {}
+
+
+def _threads_per_worker(workers: int, cfg) -> int:
+    threads = cfg.get("parallel", {}).get("threads_per_worker")
+    if threads:
+        return int(threads)
+    # делим ядра поровну, чтобы intra-op потоки torch разных воркеров не дрались за CPU
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _init_worker(cfg, num_threads: int):
+    torch.set_num_threads(num_threads)
+    _WORKER_STATE["cfg"] = cfg
+    _WORKER_STATE["timer"] = StageTimer()
+    _WORKER_STATE["ensemble"] = EnsembleDetector(
+        cfg, cache=build_detection_cache(cfg), timer=_WORKER_STATE["timer"], dedup=build_dedup_index(cfg)
+    )
+
+
+def _run_counters(ensemble: EnsembleDetector) -> Dict[str, int]:
+    """Счётчики кэша, triage, dedup и каскада ансамбля (суммируются между воркерами)."""
+    counters = {
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "triage_pages": 0,
+        "triage_pages_skipped": 0,
+        "triage_calls_saved": 0,
+        "dedup_lookups": 0,
+        "dedup_hits": 0,
+        "cascade_screened": 0,
+        "cascade_avoided": 0,
+    }
+    if ensemble.cache is not None:
+        counters["cache_hits"] = ensemble.cache.hits
+        counters["cache_misses"] = ensemble.cache.misses
+    if ensemble.triage is not None:
+        triage = ensemble.triage.stats()
+        counters["triage_pages"] = triage["pages"]
+        counters["triage_pages_skipped"] = triage["pages_skipped"]
+        counters["triage_calls_saved"] = triage["calls_saved_total"]
+    if ensemble.dedup is not None:
+        counters["dedup_lookups"] = ensemble.dedup.lookups
+        counters["dedup_hits"] = ensemble.dedup.hits
+    if ensemble.cascade is not None:
+        cascade = ensemble.cascade.stats()
+        counters["cascade_screened"] = cascade["pages_screened"]
+        counters["cascade_avoided"] = cascade["full_passes_avoided_total"]
+    return counters
+
+
+def _process_pdf_in_worker(pdf_path: str, page_range: Optional[Tuple[int, int]] = None):
+    ensemble = _WORKER_STATE["ensemble"]
+    timer = _WORKER_STATE["timer"]
+    before = _run_counters(ensemble)
+    doc_pred = process_pdf(pdf_path, _WORKER_STATE["cfg"], ensemble, timer=timer, page_range=page_range)
+    after = _run_counters(ensemble)
+    # счётчики и замеры живут в воркере — отдаём родителю прирост за документ
+    return doc_pred, {k: after[k] - before[k] for k in after}, timer.drain()
+
+
+def print_run_counters(counters: Dict[str, int], cfg) -> None:
+    if cfg.get("cache", {}).get("enabled", False):
+        lookups = counters["cache_hits"] + counters["cache_misses"]
+        rate = counters["cache_hits"] / lookups if lookups else 0.0
+        print(f"Detection cache: {counters['cache_hits']}/{lookups} pages hit ({rate:.1%})")
+
+    if cfg.get("triage", {}).get("enabled", False):
+        pages = counters["triage_pages"]
+        saved = counters["triage_calls_saved"]
+        total = pages * 3
+        rate = saved / total if total else 0.0
+        print(
+            f"Triage: {counters['triage_pages_skipped']}/{pages} pages skipped, "
+            f"{saved}/{total} page-model calls saved ({rate:.1%})"
+        )
+
+    if cfg.get("dedup", {}).get("enabled", False) and counters["dedup_lookups"]:
+        lookups = counters["dedup_lookups"]
+        rate = counters["dedup_hits"] / lookups if lookups else 0.0
+        print(f"Dedup: {counters['dedup_hits']}/{lookups} pages reused from near-duplicates ({rate:.1%})")
+
+    if cfg.get("cascade", {}).get("enabled", False):
+        screened = counters["cascade_screened"]
+        rate = counters["cascade_avoided"] / screened if screened else 0.0
+        print(
+            f"Cascade: {counters['cascade_avoided']}/{screened} full-resolution page passes "
+            f"avoided ({rate:.1%})"
+        )
+
 
-        detections = ensemble.detect_on_image(img_path)
+def _document_tasks(docs: List[Path], cfg, workers: int) -> List[Tuple[Path, Optional[Tuple[int, int]]]]:
+    """
+    Задачи для пула воркеров: (PDF, диапазон страниц или None — весь документ).
+    С parallel.split_pages большой PDF режется на диапазоны по воркерам
+    (не короче parallel.min_pages_per_shard), чтобы один документ тоже
+    обрабатывался всеми ядрами.
+    """
+    parallel_cfg = cfg.get("parallel", {})
+    if workers <= 1 or not parallel_cfg.get("split_pages", False):
+        return [(pdf, None) for pdf in docs]
 
-        # сохраним для JSON
-        doc_predictions[page_num] = {
-            "size": (width, height),
-            "detections": detections,
+    min_pages = parallel_cfg.get("min_pages_per_shard", 8)
+    tasks = []
+    for pdf in docs:
+        ranges = split_page_range(pdf_page_count(str(pdf)), workers, min_pages)
+        if len(ranges) <= 1:
+            tasks.append((pdf, None))
+        else:
+            tasks.extend((pdf, page_range) for page_range in ranges)
+    return tasks
+
+
+def run_documents(
+    docs: List[Path],
+    cfg,
+    workers: int = 1,
+    on_document: Optional[Callable[[Path, dict], None]] = None,
+    timer: Optional[StageTimer] = None,
+    collect: bool = True,
+):
+    """
+    Прогоняет список PDF и возвращает ({имя файла: предсказания} в порядке docs,
+    счётчики кэша / triage — см. _run_counters).
+
+    workers > 1 — документы (и диапазоны страниц больших документов, см.
+    _document_tasks) раскидываются по пулу процессов; результат собирается
+    в том же порядке, что и при последовательном прогоне. dedup в таком
+    прогоне выключается: его попадания зависят от порядка обработки страниц.
+    on_document(pdf, предсказания) вызывается сразу по готовности каждого
+    документа (в порядке завершения) — например, чтобы записать шард.
+    timer — StageTimer, в который собираются замеры стадий (из воркеров тоже).
+    collect=False — предсказания не копятся (первый элемент результата пустой):
+    документы забирает on_document, например StreamingResultsWriter.
+    """
+    all_docs_predictions = {}
+    run_counters: Dict[str, int] = {}
+
+    tasks = _document_tasks(docs, cfg, workers) if workers > 1 else []
+
+    if len(tasks) <= 1:
+        # модели грузим один раз на весь прогон, а не на каждый PDF
+        ensemble = EnsembleDetector(
+            cfg, cache=build_detection_cache(cfg), timer=timer, dedup=build_dedup_index(cfg)
+        )
+        try:
+            for pdf in docs:
+                doc_pred = process_pdf(str(pdf), cfg, ensemble, timer=timer or NULL_TIMER)
+                if collect:
+                    all_docs_predictions[pdf.name] = doc_pred
+                if on_document is not None:
+                    on_document(pdf, doc_pred)
+        finally:
+            ensemble.close()
+        return all_docs_predictions, _run_counters(ensemble)
+
+    workers = min(workers, len(tasks))
+    if cfg.get("dedup", {}).get("enabled", False):
+        # у каждого воркера свой индекс, и попадание зависит от того, какой вариант
+        # страницы воркер увидел первым, — результат зависел бы от расписания
+        print("Dedup: disabled for parallel runs (results would depend on scheduling); use --workers 1")
+        cfg = {**cfg, "dedup": {**cfg["dedup"], "enabled": False}}
+
+    # сколько шардов каждого документа ещё не готово; страницы готовых шардов копятся здесь
+    shards_left = {}
+    for pdf, _ in tasks:
+        shards_left[pdf.name] = shards_left.get(pdf.name, 0) + 1
+    doc_pages: Dict[str, dict] = {}
+
+    # spawn, а не fork: форк процесса с уже поднятыми потоками torch может зависнуть
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(cfg, _threads_per_worker(workers, cfg)),
+    ) as pool:
+        futures = {
+            pool.submit(_process_pdf_in_worker, str(pdf), page_range): pdf for pdf, page_range in tasks
         }
+        finished = {}
+        for future in as_completed(futures):
+            pdf = futures[future]
+            shard_pred, counters, samples = future.result()
+            for k, v in counters.items():
+                run_counters[k] = run_counters.get(k, 0) + v
+            if timer is not None:
+                timer.merge(samples)
+
+            doc_pages.setdefault(pdf.name, {}).update(shard_pred)
+            shards_left[pdf.name] -= 1
+            if shards_left[pdf.name]:
+                continue
+
+            # все диапазоны документа готовы — страницы снова по порядку
+            doc_pred = dict(sorted(doc_pages.pop(pdf.name).items()))
+            if collect:
+                finished[pdf.name] = doc_pred
+            if on_document is not None:
+                on_document(pdf, doc_pred)
 
-        # визуализация
-        out_viz_path = Path(viz_dir) / f"{Path(pdf_path).stem}_page_{page_num:04d}_viz.png"
-        draw_boxes(img_path, detections, str(out_viz_path))
+    # собираем в порядке docs, а не завершения — predictions.json детерминирован
+    for pdf in docs:
+        if collect:
+            all_docs_predictions[pdf.name] = finished[pdf.name]
 
-    return doc_predictions
+    return all_docs_predictions, run_counters
 
 
 def main():
@@ -64,21 +374,46 @@ def main():
         default=None,
         help="Path to output JSON file (if None, will use paths.output_json)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes for documents (if None, will use parallel.workers)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip PDFs unchanged since the last run (manifest + per-document shards)",
+    )
+    parser.add_argument(
+        "--viz",
+        choices=VIZ_MODES,
+        default=None,
+        help="Which pages to visualize: all, detections-only or none (if None, will use viz.mode)",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print a per-stage time breakdown (render, each model, crop pass, NMS, viz, JSON)",
+    )
 
     args = parser.parse_args()
     cfg = load_config(args.config)
+    if args.viz is not None:
+        cfg.setdefault("viz", {})["mode"] = args.viz
 
     pdf_input = Path(args.pdf)
-    all_docs_predictions = {}
 
     if pdf_input.is_file():
         docs = [pdf_input]
     else:
         docs = sorted(pdf_input.glob("*.pdf"))
 
-    for pdf in docs:
-        doc_pred = process_pdf(str(pdf), cfg)
-        all_docs_predictions[pdf.name] = doc_pred
+    timer = StageTimer() if args.timings else None
+
+    workers = args.workers
+    if workers is None:
+        workers = cfg.get("parallel", {}).get("workers", 1)
 
     output_json_dir = cfg["paths"]["output_json"]
     if args.output_json is None:
@@ -86,8 +421,44 @@ def main():
     else:
         output_path = Path(args.output_json)
 
-    save_results_json(all_docs_predictions, str(output_path))
+    # каждый документ дописывается в predictions.jsonl сразу по готовности,
+    # predictions.json собирается из него в конце
+    writer = StreamingResultsWriter(str(output_path))
+    json_timer = timer or NULL_TIMER
+
+    def write_document(pdf: Path, doc_pred: dict) -> None:
+        with json_timer.stage("json_write", pages=0):
+            writer.add_document(pdf.name, doc_pred)
+
+    if args.incremental:
+        manifest_dir = cfg.get("incremental", {}).get(
+            "manifest_dir", str(Path(cfg["paths"]["output_json"]) / "incremental")
+        )
+        manifest = RunManifest(manifest_dir, run_fingerprint(cfg))
+        todo = [pdf for pdf in docs if manifest.needs_update(pdf)]
+        print(f"Incremental run: {len(todo)} of {len(docs)} PDFs are new or changed")
+
+        # шард каждого документа пишется сразу по готовности;
+        # если менять нечего, модели не грузим — JSON собирается из шардов
+        run_counters = None
+        if todo:
+            _, run_counters = run_documents(
+                todo, cfg, workers, on_document=manifest.record, timer=timer, collect=False
+            )
+        for pdf in docs:
+            write_document(pdf, manifest.load(pdf.name))
+    else:
+        _, run_counters = run_documents(
+            docs, cfg, workers, on_document=write_document, timer=timer, collect=False
+        )
+
+    with json_timer.stage("json_write", pages=0):
+        writer.close(order=[pdf.name for pdf in docs])
     print(f"Saved predictions to {output_path}")
+    if run_counters is not None:
+        print_run_counters(run_counters, cfg)
+    if timer is not None:
+        print(format_stage_summary(timer.summary()))
 
 
 if __name__ == "__main__":
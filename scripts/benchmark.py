@@ -0,0 +1,230 @@
+"""
+Бенчмарк всего конвейера (main_infer) на корпусе PDF с разбивкой по стадиям.
+
+    python -m scripts.benchmark                                   # data/input_pdfs, параметры из config.yaml
+    python -m scripts.benchmark --batch_sizes 1 4 8 --workers 1 2 --img_sizes 640 1024
+    python -m scripts.benchmark --save_baseline data/outputs/benchmark/baseline.json
+    python -m scripts.benchmark --baseline data/outputs/benchmark/baseline.json   # код 1 при регрессии
+
+Каждая точка сетки (batch_size x workers x img_size) запускается в отдельном
+процессе: модели грузятся заново, а peak RSS меряется честно для этой точки.
+Кэш детекций на время замера выключается, визуализация и JSON пишутся во
+временный каталог. По каждой стадии (pdf_open, rasterize, predict.<модель>,
+crop_pass, nms, viz, json_write, ...) — pages/sec и p50/p95/p99 на страницу.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_RESULT_MARKER = "BENCH_RESULT "
+
+# стадии быстрее этого (p95 в baseline) не сравниваем — там в основном шум
+_MIN_COMPARABLE_MS = 1.0
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss на Linux — в КБ, на macOS — в байтах
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def run_point(config: str, pdf_dir: str, batch_size: int, workers: int, img_size: int,
+              max_docs: Optional[int]) -> Dict:
+    """Одна точка сетки в текущем процессе (вызывается из дочернего процесса)."""
+    from main_infer import load_config, run_documents
+    from utils.json_utils import save_results_json
+    from utils.timing_utils import StageTimer
+
+    cfg = load_config(config)
+    cfg["inference"]["batch_size"] = batch_size
+    cfg["inference"]["img_size"] = img_size
+    cfg.setdefault("cache", {})["enabled"] = False  # иначе повторные страницы не считаются
+
+    docs = sorted(Path(pdf_dir).glob("*.pdf"))
+    if max_docs:
+        docs = docs[:max_docs]
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        cfg["paths"]["output_viz"] = str(Path(tmp) / "viz")
+        Path(cfg["paths"]["output_viz"]).mkdir()
+
+        timer = StageTimer()
+        start = time.perf_counter()
+        predictions, _ = run_documents(docs, cfg, workers, timer=timer)
+        with timer.stage("json_write", pages=0):
+            save_results_json(predictions, str(Path(tmp) / "predictions.json"))
+        wall = time.perf_counter() - start
+
+    pages = sum(len(doc) for doc in predictions.values())
+    return {
+        "params": {"batch_size": batch_size, "workers": workers, "img_size": img_size},
+        "docs": len(docs),
+        "pages": pages,
+        "wall_sec": round(wall, 3),
+        "pages_per_sec": round(pages / wall, 3) if wall > 0 else None,
+        "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_worker_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "stages": timer.summary(),
+    }
+
+
+def run_point_subprocess(args, batch_size: int, workers: int, img_size: int) -> Dict:
+    params = {
+        "config": args.config,
+        "pdf_dir": args.pdf_dir,
+        "batch_size": batch_size,
+        "workers": workers,
+        "img_size": img_size,
+        "max_docs": args.max_docs,
+    }
+    proc = subprocess.run(
+        [sys.executable, "-m", "scripts.benchmark", "_point", json.dumps(params)],
+        capture_output=True,
+        text=True,
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(_RESULT_MARKER):
+            return json.loads(line[len(_RESULT_MARKER):])
+    sys.stderr.write(proc.stderr[-4000:])
+    raise RuntimeError(f"Benchmark point {params} failed with exit code {proc.returncode}")
+
+
+def _key(run: Dict) -> tuple:
+    p = run["params"]
+    return p["batch_size"], p["workers"], p["img_size"]
+
+
+def compare_with_baseline(runs: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Регрессии относительно baseline для совпадающих точек сетки:
+    pages/sec ниже, p95 стадий и peak RSS выше, чем baseline ± tolerance.
+    """
+    base_runs = {_key(r): r for r in baseline.get("runs", [])}
+    regressions = []
+    for run in runs:
+        base = base_runs.get(_key(run))
+        if base is None:
+            continue
+        label = "bs={} workers={} img={}".format(*_key(run))
+
+        if run["pages_per_sec"] < base["pages_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{label}: pages/sec {run['pages_per_sec']:.2f} < baseline {base['pages_per_sec']:.2f}"
+            )
+        if run["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{label}: peak RSS {run['peak_rss_mb']} MB > baseline {base['peak_rss_mb']} MB"
+            )
+        for stage, s in run["stages"].items():
+            b = base["stages"].get(stage)
+            if b is None or b["p95_ms"] < _MIN_COMPARABLE_MS:
+                continue
+            if s["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{label}: {stage} p95 {s['p95_ms']:.1f} ms > baseline {b['p95_ms']:.1f} ms"
+                )
+    return regressions
+
+
+def _meta(args) -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import torch
+        torch_version = torch.__version__
+    except ImportError:
+        torch_version = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": args.config,
+        "pdf_dir": args.pdf_dir,
+        "max_docs": args.max_docs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    parser.add_argument("--pdf_dir", default="data/input_pdfs")
+    parser.add_argument("--config", default="config/config.yaml")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=None,
+                        help="inference.batch_size values (default: from config)")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="Worker process counts (default: parallel.workers from config)")
+    parser.add_argument("--img_sizes", type=int, nargs="+", default=None,
+                        help="inference.img_size values (default: from config)")
+    parser.add_argument("--max_docs", type=int, default=None, help="Only the first N PDFs")
+    parser.add_argument("--output", default="data/outputs/benchmark/results.json")
+    parser.add_argument("--baseline", default=None, help="Compare against this results JSON")
+    parser.add_argument("--save_baseline", default=None, help="Also save the results as a baseline here")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed relative slowdown before a change counts as a regression")
+    parser.add_argument("--quiet", action="store_true", help="Do not print per-stage tables")
+
+    if len(sys.argv) > 2 and sys.argv[1] == "_point":
+        # дочерний процесс одной точки сетки
+        p = json.loads(sys.argv[2])
+        result = run_point(p["config"], p["pdf_dir"], p["batch_size"], p["workers"], p["img_size"], p["max_docs"])
+        print(_RESULT_MARKER + json.dumps(result))
+        return
+
+    args = parser.parse_args()
+
+    from main_infer import load_config
+    from utils.timing_utils import format_stage_summary
+
+    cfg = load_config(args.config)
+    batch_sizes = args.batch_sizes or [cfg["inference"].get("batch_size", 1)]
+    workers_list = args.workers or [cfg.get("parallel", {}).get("workers", 1)]
+    img_sizes = args.img_sizes or [cfg["inference"]["img_size"]]
+
+    runs = []
+    for batch_size, workers, img_size in itertools.product(batch_sizes, workers_list, img_sizes):
+        print(f"== batch_size={batch_size} workers={workers} img_size={img_size}", flush=True)
+        run = run_point_subprocess(args, batch_size, workers, img_size)
+        runs.append(run)
+        print(
+            f"   {run['pages']} pages in {run['wall_sec']:.1f} s: {run['pages_per_sec']:.2f} pages/s, "
+            f"peak RSS {run['peak_rss_mb']} MB (workers {run['peak_worker_rss_mb']} MB)"
+        )
+        if not args.quiet:
+            print(format_stage_summary(run["stages"]))
+
+    results = {"meta": _meta(args), "runs": runs}
+    for path in filter(None, [args.output, args.save_baseline]):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Saved benchmark results to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(runs, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions vs {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"No regressions vs {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
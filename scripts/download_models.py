@@ -1,6 +1,25 @@
-from pathlib import Path
+"""
+Веса моделей: скачивание, экспорт под CPU-бэкенды и проверка совпадения с PyTorch.
+
+    python scripts/download_models.py                     # скачать .pt (как раньше)
+    python -m scripts.download_models export --backend onnxruntime [--int8]
+    python -m scripts.download_models export --backend openvino [--int8]
+    python -m scripts.download_models parity --backend onnxruntime [--int8]
+
+export/parity берут модели из paths.models в config.yaml и запускаются из корня
+репозитория (им нужны utils/ и src/). INT8-квантование калибруется на страницах
+из data/input_pdfs. Перед тем как переключить inference.backend в config.yaml,
+прогоните parity: он сравнивает детекции бэкенда с PyTorch на тех же страницах.
+"""
+import argparse
+import json
 import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
 
+import numpy as np
 from ultralytics import YOLO
 
 
@@ -13,7 +32,7 @@ def download_and_save(model_name: str, output_path: str):
     shutil.copy(model.ckpt_path, out_path)
 
 
-def main():
+def download_all():
     # примеры, подставь реальные имена моделей с HF/Ultralytics Hub
     download_and_save(
         "keremberke/yolov8m-signature-detection",
@@ -29,5 +48,294 @@ def main():
     )
 
 
+# ---- страницы для калибровки и parity ----
+
+def sample_pages(pdf_dir: str, num_pages: int, dpi: int = 72) -> List[np.ndarray]:
+    """
+    До num_pages страниц из PDF в pdf_dir: по кругу по документам,
+    чтобы в выборку попали все типы сканов, а не только первый файл.
+    """
+    from utils.pds_utils import iter_pdf_pages
+
+    iters = [iter_pdf_pages(str(p), dpi=dpi) for p in sorted(Path(pdf_dir).glob("*.pdf"))]
+    pages: List[np.ndarray] = []
+    while iters and len(pages) < num_pages:
+        for it in list(iters):
+            page = next(it, None)
+            if page is None:
+                iters.remove(it)
+                continue
+            pages.append(page.image)
+            if len(pages) >= num_pages:
+                break
+    for it in iters:
+        it.close()
+    return pages
+
+
+def write_calibration_dataset(pages: List[np.ndarray], out_dir: Path, names: Dict) -> Path:
+    """Датасет в формате ultralytics (только картинки) для INT8-калибровки OpenVINO."""
+    import cv2
+
+    images_dir = out_dir / "images"
+    if images_dir.exists():
+        shutil.rmtree(images_dir)
+    images_dir.mkdir(parents=True)
+    for i, image in enumerate(pages):
+        cv2.imwrite(str(images_dir / f"calib_{i:04d}.png"), image)
+
+    data_yaml = out_dir / "calibration.yaml"
+    with open(data_yaml, "w", encoding="utf-8") as f:
+        json.dump(  # JSON — валидный YAML
+            {"path": str(out_dir.resolve()), "train": "images", "val": "images", "names": names},
+            f,
+            ensure_ascii=False,
+        )
+    return data_yaml
+
+
+# ---- экспорт ----
+
+class _LetterboxCalibrationReader:
+    """CalibrationDataReader для onnxruntime: страницы по одной, letterbox как у детекторов."""
+
+    def __init__(self, pages: List[np.ndarray], img_size: int, input_name: str):
+        self.pages = pages
+        self.img_size = img_size
+        self.input_name = input_name
+        self._index = 0
+
+    def get_next(self):
+        from src.detectors.preprocess import letterbox_batch
+
+        if self._index >= len(self.pages):
+            return None
+        batch, _ = letterbox_batch([self.pages[self._index]], self.img_size)
+        self._index += 1
+        return {self.input_name: batch.numpy()}
+
+    def rewind(self):
+        self._index = 0
+
+
+def quantize_onnx_int8(fp32_path: Path, int8_path: Path, pages: List[np.ndarray], img_size: int) -> None:
+    """Статическая INT8-квантизация ONNX (QDQ, по каналам) с калибровкой на страницах."""
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    input_name = onnxruntime.InferenceSession(
+        str(fp32_path), providers=["CPUExecutionProvider"]
+    ).get_inputs()[0].name
+
+    quantize_static(
+        str(fp32_path),
+        str(int8_path),
+        _LetterboxCalibrationReader(pages, img_size, input_name),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+
+    # ultralytics читает stride/names/imgsz из metadata_props — переносим их из fp32-модели
+    fp32 = onnx.load(str(fp32_path), load_external_data=False)
+    int8 = onnx.load(str(int8_path))
+    del int8.metadata_props[:]
+    for prop in fp32.metadata_props:
+        meta = int8.metadata_props.add()
+        meta.key, meta.value = prop.key, prop.value
+    onnx.save(int8, str(int8_path))
+
+
+def export_model(model_path: str, backend: str, int8: bool, img_size: int, pages, calib_dir: Path) -> Path:
+    from src.detectors.backends import exported_model_path
+
+    model = YOLO(model_path)
+    target = exported_model_path(model_path, backend, int8)
+
+    if backend == "onnxruntime":
+        # dynamic: батч и размер входа произвольные (batch_size, img_size_stamp, shared_preprocess)
+        fp32_path = Path(model.export(format="onnx", dynamic=True, simplify=True, imgsz=img_size))
+        if int8:
+            quantize_onnx_int8(fp32_path, target, pages, img_size)
+    elif backend == "openvino":
+        data = None
+        if int8:
+            data = str(write_calibration_dataset(pages, calib_dir / Path(model_path).stem, model.names))
+        model.export(format="openvino", dynamic=True, int8=int8, data=data, imgsz=img_size)
+    else:
+        raise ValueError(f"Nothing to export for backend '{backend}'")
+
+    print(f"Exported {model_path} → {target}")
+    return target
+
+
+# ---- parity ----
+
+def match_detections(ref: List[Dict], other: List[Dict], iou_thresh: float):
+    """Жадное сопоставление детекций по IoU (от самых уверенных ref). -> [(i_ref, j_other, iou)]"""
+    from src.detectors import box_ops
+
+    if not ref or not other:
+        return []
+    ious = box_ops.iou_matrix(
+        np.array([d["bbox"] for d in ref]), np.array([d["bbox"] for d in other])
+    )
+    taken = set()
+    pairs = []
+    for i in sorted(range(len(ref)), key=lambda k: -ref[k]["score"]):
+        for j in np.argsort(-ious[i], kind="stable"):
+            if ious[i, j] < iou_thresh:
+                break
+            if j not in taken:
+                taken.add(int(j))
+                pairs.append((i, int(j), float(ious[i, j])))
+                break
+    return pairs
+
+
+def _timed_predict(detector, pages, batch_size):
+    """
+    Детекции на страницах через общий letterbox (как при shared_preprocess):
+    оба бэкенда получают одинаковый входной тензор, и сравнивается только
+    сама модель, а не разный паддинг ultralytics для .pt и экспортов.
+    """
+    from src.detectors.preprocess import boxes_to_page, letterbox_batch
+
+    dets: List[List[Dict]] = []
+    start = time.perf_counter()
+    for i in range(0, len(pages), batch_size):
+        batch, metas = letterbox_batch(pages[i:i + batch_size], detector.img_size)
+        for page_dets, meta in zip(detector.predict_tensor(batch), metas):
+            dets.append(boxes_to_page(page_dets, meta))
+    return dets, (time.perf_counter() - start) * 1000 / max(len(pages), 1)
+
+
+def parity_report(cfg, model_name: str, backend: str, int8: bool, pages, iou_thresh: float) -> Dict:
+    from src.detectors.backends import exported_model_path
+    from src.detectors.qr_detector import QrDetector
+    from src.detectors.signature_detector import SignatureDetector
+    from src.detectors.stamp_detectop import StampDetector
+
+    detector_cls = {"signature": SignatureDetector, "stamp": StampDetector, "qr": QrDetector}[model_name]
+    inf_cfg = cfg["inference"]
+    conf_key = "signature_global" if model_name == "signature" else model_name
+    kwargs = dict(
+        img_size=inf_cfg["img_size"],
+        conf_threshold=inf_cfg["conf_threshold"][conf_key],
+        iou_threshold=inf_cfg["iou_nms"][model_name],
+    )
+    model_path = cfg["paths"]["models"][model_name]
+    batch_size = inf_cfg.get("batch_size", 1)
+
+    ref_det = detector_cls(model_path, warmup=True, **kwargs)
+    other_det = detector_cls(str(exported_model_path(model_path, backend, int8)), warmup=True, **kwargs)
+    try:
+        ref, ref_ms = _timed_predict(ref_det, pages, batch_size)
+        other, other_ms = _timed_predict(other_det, pages, batch_size)
+    finally:
+        ref_det.close()
+        other_det.close()
+
+    n_ref = sum(len(d) for d in ref)
+    n_other = sum(len(d) for d in other)
+    ious, score_diffs = [], []
+    for page_ref, page_other in zip(ref, other):
+        for i, j, iou in match_detections(page_ref, page_other, iou_thresh):
+            ious.append(iou)
+            score_diffs.append(abs(page_ref[i]["score"] - page_other[j]["score"]))
+
+    matched = len(ious)
+    return {
+        "model": model_name,
+        "backend": backend + ("-int8" if int8 else ""),
+        "pages": len(pages),
+        "torch_boxes": n_ref,
+        "backend_boxes": n_other,
+        "matched": matched,
+        "recall": matched / n_ref if n_ref else 1.0,
+        "precision": matched / n_other if n_other else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 1.0,
+        "max_score_diff": float(np.max(score_diffs)) if score_diffs else 0.0,
+        "torch_ms_per_page": round(ref_ms, 1),
+        "backend_ms_per_page": round(other_ms, 1),
+    }
+
+
+# ---- CLI ----
+
+def main():
+    parser = argparse.ArgumentParser(description="Model weights: download, export, parity check")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("download", help="Download .pt weights (default)")
+
+    for name in ("export", "parity"):
+        p = sub.add_parser(name)
+        p.add_argument("--backend", choices=["onnxruntime", "openvino"], required=True)
+        p.add_argument("--int8", action="store_true", help="INT8 post-training quantization")
+        p.add_argument("--config", default="config/config.yaml")
+        p.add_argument("--models", nargs="+", default=None, help="Subset of paths.models (default: all)")
+        p.add_argument("--pdf_dir", default="data/input_pdfs", help="PDFs for calibration / comparison pages")
+        p.add_argument("--pages", type=int, default=64 if name == "export" else 32)
+
+    parity = sub.choices["parity"]
+    parity.add_argument("--iou", type=float, default=0.5, help="IoU for matching torch vs backend boxes")
+    parity.add_argument("--min_recall", type=float, default=0.95)
+    parity.add_argument("--min_precision", type=float, default=0.95)
+    parity.add_argument("--min_iou", type=float, default=0.9, help="Minimum mean IoU of matched boxes")
+    parity.add_argument("--report", default=None, help="Write the parity report to this JSON file")
+
+    export = sub.choices["export"]
+    export.add_argument("--calib_dir", default="data/calibration", help="Where to put OpenVINO calibration images")
+
+    args = parser.parse_args()
+    if args.command in (None, "download"):
+        download_all()
+        return
+
+    import yaml
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    models = args.models or list(cfg["paths"]["models"])
+    img_size = cfg["inference"]["img_size"]
+    pages = sample_pages(args.pdf_dir, args.pages, dpi=cfg.get("render", {}).get("dpi", 72))
+    print(f"{len(pages)} pages from {args.pdf_dir}")
+
+    if args.command == "export":
+        for name in models:
+            export_model(
+                cfg["paths"]["models"][name], args.backend, args.int8, img_size, pages, Path(args.calib_dir)
+            )
+        return
+
+    reports = [parity_report(cfg, name, args.backend, args.int8, pages, args.iou) for name in models]
+    failed = False
+    for r in reports:
+        ok = (
+            r["recall"] >= args.min_recall
+            and r["precision"] >= args.min_precision
+            and r["mean_iou"] >= args.min_iou
+        )
+        r["passed"] = ok
+        failed |= not ok
+        print(
+            f"[{'OK' if ok else 'FAIL'}] {r['model']:<9} {r['backend']:<16} "
+            f"boxes {r['torch_boxes']}/{r['backend_boxes']}  recall {r['recall']:.3f}  "
+            f"precision {r['precision']:.3f}  mean IoU {r['mean_iou']:.3f}  "
+            f"max Δscore {r['max_score_diff']:.3f}  "
+            f"{r['torch_ms_per_page']} → {r['backend_ms_per_page']} ms/page"
+        )
+
+    if args.report:
+        Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
 if __name__ == "__main__":
     main()
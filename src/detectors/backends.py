@@ -0,0 +1,62 @@
+"""
+Чем исполнять YOLO-модели: PyTorch (.pt) или экспортированные модели
+для CPU — ONNX Runtime (.onnx) и OpenVINO (<stem>_openvino_model/).
+
+ultralytics сам открывает любой из этих форматов (AutoBackend), поэтому
+детекторы и формат их детекций от бэкенда не зависят — меняется только
+путь к весам. Экспорт и проверка совпадения с PyTorch:
+    python -m scripts.download_models export --backend onnxruntime [--int8]
+    python -m scripts.download_models parity --backend onnxruntime [--int8]
+"""
+from pathlib import Path
+from typing import Dict, Tuple
+
+BACKENDS = ("torch", "onnxruntime", "openvino")
+
+
+def exported_model_path(model_path: str, backend: str, int8: bool = False) -> Path:
+    """
+    Куда export кладёт модель для бэкенда (рядом с .pt):
+      onnxruntime: best.onnx / best_int8.onnx
+      openvino:    best_openvino_model/ / best_int8_openvino_model/ (имена как у ultralytics)
+    """
+    path = Path(model_path)
+    suffix = "_int8" if int8 else ""
+    if backend == "torch":
+        return path
+    if backend == "onnxruntime":
+        return path.with_name(f"{path.stem}{suffix}.onnx")
+    if backend == "openvino":
+        return path.with_name(f"{path.stem}{suffix}_openvino_model")
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+
+
+def backend_settings(cfg, model_name: str) -> Tuple[str, bool]:
+    """(бэкенд, int8) модели из inference.backend / inference.int8 в config.yaml."""
+    inf_cfg = cfg["inference"]
+    backend = inf_cfg.get("backend", {}).get(model_name, "torch")
+    int8 = bool(inf_cfg.get("int8", False)) and backend != "torch"
+    return backend, int8
+
+
+def resolve_model_path(cfg, model_name: str) -> str:
+    """Путь к весам модели с учётом выбранного бэкенда (экспорт должен уже существовать)."""
+    model_path = cfg["paths"]["models"][model_name]
+    backend, int8 = backend_settings(cfg, model_name)
+    path = exported_model_path(model_path, backend, int8)
+    if backend != "torch" and not path.exists():
+        raise FileNotFoundError(
+            f"{path} not found for {model_name} ({backend}{', int8' if int8 else ''}); "
+            f"run: python -m scripts.download_models export --backend {backend}"
+            f"{' --int8' if int8 else ''} --models {model_name}"
+        )
+    return str(path)
+
+
+def model_files(cfg) -> Dict[str, str]:
+    """{имя модели: путь к весам выбранного бэкенда} — без проверки существования."""
+    files = {}
+    for name, model_path in cfg["paths"]["models"].items():
+        backend, int8 = backend_settings(cfg, name)
+        files[name] = str(exported_model_path(model_path, backend, int8))
+    return files
@@ -0,0 +1,160 @@
+from typing import List, Dict, Optional, Sequence, Union
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+from .model_registry import acquire_model, release_model
+from .preprocess import InputSizePolicy
+
+
+ImageLike = Union[str, np.ndarray]
+
+
+class YoloDetector:
+    """
+    Общая часть детекторов на YOLO: модель из реестра, батчевый predict
+    и перевод результатов ultralytics в наш формат детекций.
+
+    Наследник задаёт category и, если нужно, _class_ids().
+    """
+
+    category: str = ""
+
+    def __init__(
+        self,
+        model_path: str,
+        img_size: int = 1024,
+        conf_threshold: float = 0.25,
+        iou_threshold: float = 0.5,
+        warmup: bool = False,
+        input_policy: Optional[InputSizePolicy] = None,
+    ):
+        self.model_path = Path(model_path)
+        # экспортированные модели (.onnx, *_openvino_model/, см. backends.py) не хранят
+        # задачу так же надёжно, как .pt — подсказываем ultralytics явно
+        options = {} if self.model_path.suffix == ".pt" else {"task": "detect"}
+        # модель берём из общего реестра: одинаковые веса грузятся один раз на процесс
+        self.model = acquire_model(
+            str(self.model_path), warmup_size=img_size if warmup else None, **options
+        )
+        self.img_size = img_size
+        # размер входа на картинку: imgsz=img_size (fixed) или прямоугольник по пропорциям (preprocess.py)
+        self.input_policy = input_policy or InputSizePolicy(img_size)
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+
+    def close(self) -> None:
+        """Отдаёт модель обратно в реестр."""
+        if self.model is not None:
+            release_model(self.model)
+            self.model = None
+
+    def _class_ids(self) -> Optional[List[int]]:
+        """Какие классы модели оставлять (None — все)."""
+        return None
+
+    def predict(self, image: ImageLike) -> List[Dict]:
+        """
+        Детекция на одном изображении.
+
+        :param image: путь до изображения или np.ndarray (H, W, 3) в BGR
+        :return: список словарей {"category", "bbox": [x, y, w, h], "score"}
+        """
+        return self.predict_batch([image])[0]
+
+    def predict_batch(
+        self,
+        images: Sequence[ImageLike],
+        batch_size: Optional[int] = None,
+    ) -> List[List[Dict]]:
+        """
+        Детекция на нескольких изображениях: по batch_size картинок за один
+        вызов model.predict (None — все сразу). Возвращает список детекций
+        на каждое изображение в исходном порядке.
+
+        При прямоугольном входе (input_policy rect / adaptive) картинки сначала
+        группируются по размеру входа: в одной пачке — только одинаковые формы.
+        """
+        images = list(images)
+        if not images:
+            return []
+
+        if self.input_policy.mode == "fixed":
+            groups = {(self.img_size, self.img_size): list(range(len(images)))}
+        else:
+            arrays = [self._as_array(img) for img in images]
+            groups = self.input_policy.group_by_shape(arrays)
+            images = arrays
+
+        detections: List[Optional[List[Dict]]] = [None] * len(images)
+        for shape, idxs in groups.items():
+            step = batch_size or len(idxs)
+            for start in range(0, len(idxs), step):
+                chunk = idxs[start:start + step]
+                results = self.model.predict(
+                    source=[images[i] for i in chunk],
+                    imgsz=list(shape) if shape[0] != shape[1] else shape[0],
+                    conf=self.conf_threshold,
+                    iou=self.iou_threshold,
+                    classes=self._class_ids(),
+                    verbose=False,
+                )
+                for i, r in zip(chunk, results):
+                    detections[i] = self._result_to_detections(r)
+
+        return detections
+
+    @staticmethod
+    def _as_array(image: ImageLike) -> np.ndarray:
+        """Размер нужен до predict — путь декодируем сразу."""
+        if isinstance(image, np.ndarray):
+            return image
+        array = cv2.imread(str(image))
+        if array is None:
+            raise ValueError(f"Failed to read image: {image}")
+        return array
+
+    def predict_tensor(self, batch: torch.Tensor) -> List[List[Dict]]:
+        """
+        Детекция на готовом letterbox-тензоре (B, 3, H, W), RGB, float 0..1
+        (см. preprocess.letterbox_batch). ultralytics не делает своего
+        препроцессинга, боксы возвращаются в координатах тензора.
+        """
+        results = self.model.predict(
+            source=batch,
+            imgsz=tuple(batch.shape[2:]),
+            conf=self.conf_threshold,
+            iou=self.iou_threshold,
+            classes=self._class_ids(),
+            verbose=False,
+        )
+        return [self._result_to_detections(r) for r in results]
+
+    def _result_to_detections(self, result) -> List[Dict]:
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            return []
+
+        class_ids = self._class_ids()
+
+        xyxy = boxes.xyxy.cpu().numpy()  # (N, 4) -> x1, y1, x2, y2
+        confs = boxes.conf.cpu().numpy()  # (N,)
+        classes = boxes.cls.cpu().numpy()  # (N,)
+
+        detections: List[Dict] = []
+        for (x1, y1, x2, y2), score, cls in zip(xyxy, confs, classes):
+            # на всякий случай дополнительно фильтруем по классу
+            if class_ids is not None and int(cls) not in class_ids:
+                continue
+
+            detections.append(
+                {
+                    "category": self.category,
+                    "bbox": [float(x1), float(y1), float(x2 - x1), float(y2 - y1)],
+                    "score": float(score),
+                }
+            )
+
+        return detections
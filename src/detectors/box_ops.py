@@ -0,0 +1,283 @@
+"""
+Векторный post-processing боксов на NumPy.
+
+Все боксы — массивы (N, 4) в формате [x, y, w, h] (как в наших детекциях).
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# начиная с такого числа пар считаем IoU только для соседей по сетке
+DENSE_PAIRS = 250_000
+
+
+def to_xyxy(boxes: np.ndarray) -> np.ndarray:
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Попарный IoU (N, M) для боксов xywh; формула как у bbox_iou_xywh."""
+    a = to_xyxy(a)
+    b = to_xyxy(b)
+
+    inter_w = np.clip(
+        np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None
+    )
+    inter_h = np.clip(
+        np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None
+    )
+    inter = inter_w * inter_h
+
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter + 1e-6
+    return inter / union
+
+
+def pair_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU для пар a[k] <-> b[k] (массивы одинаковой длины)."""
+    a = to_xyxy(a)
+    b = to_xyxy(b)
+    inter_w = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a + area_b - inter + 1e-6)
+
+
+class GridIndex:
+    """
+    Пространственная сетка для плотных страниц: бокс попадает во все ячейки,
+    которые он задевает. Пересекаться могут только боксы с общей ячейкой,
+    поэтому IoU считается лишь для таких пар, а не для всех N x M.
+    """
+
+    def __init__(self, boxes: np.ndarray, cell_size: Optional[float] = None):
+        self.xyxy = to_xyxy(boxes)
+        if cell_size is None:
+            sizes = np.concatenate([self.xyxy[:, 2] - self.xyxy[:, 0], self.xyxy[:, 3] - self.xyxy[:, 1]])
+            cell_size = float(np.median(sizes)) * 2 if len(sizes) else 1.0
+        self.cell_size = max(cell_size, 1.0)
+
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, (cx0, cy0, cx1, cy1) in enumerate(self._cell_ranges(self.xyxy)):
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.cells.setdefault((cx, cy), []).append(i)
+
+    def _cell_ranges(self, xyxy: np.ndarray) -> np.ndarray:
+        return np.floor(xyxy / self.cell_size).astype(int)
+
+    def candidate_pairs(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Пары (i в query, j в индексе), у которых есть общая ячейка."""
+        pairs = set()
+        for i, (cx0, cy0, cx1, cy1) in enumerate(self._cell_ranges(to_xyxy(query))):
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    for j in self.cells.get((cx, cy), ()):
+                        pairs.add((i, j))
+        if not pairs:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        arr = np.array(sorted(pairs), dtype=int)
+        return arr[:, 0], arr[:, 1]
+
+
+def _neighbours(boxes: np.ndarray, iou_thresh: float) -> List[np.ndarray]:
+    """Для каждого бокса — индексы боксов с IoU >= iou_thresh (через сетку)."""
+    grid = GridIndex(boxes)
+    qi, qj = grid.candidate_pairs(boxes)
+    mask = qi != qj
+    qi, qj = qi[mask], qj[mask]
+    ious = pair_iou(boxes[qi], boxes[qj])
+    hit = ious >= iou_thresh
+    qi, qj = qi[hit], qj[hit]
+
+    result: List[List[int]] = [[] for _ in range(len(boxes))]
+    for i, j in zip(qi.tolist(), qj.tolist()):
+        result[i].append(j)
+    return [np.array(r, dtype=int) for r in result]
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_thresh: float) -> np.ndarray:
+    """
+    Жадный NMS. Возвращает индексы оставленных боксов по убыванию score
+    (при равных score — в исходном порядке, как у sorted(..., reverse=True)).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    n = len(boxes)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+    suppressed = np.zeros(n, dtype=bool)
+    keep = []
+
+    if n * n <= DENSE_PAIRS:
+        ious = iou_matrix(boxes, boxes)
+        for i in order:
+            if suppressed[i]:
+                continue
+            keep.append(i)
+            suppressed |= ious[i] >= iou_thresh
+    else:
+        neighbours = _neighbours(boxes, iou_thresh)
+        for i in order:
+            if suppressed[i]:
+                continue
+            keep.append(i)
+            suppressed[neighbours[i]] = True
+
+    return np.array(keep, dtype=int)
+
+
+def soft_nms(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    sigma: float = 0.5,
+    min_score: float = 0.001,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gaussian Soft-NMS: вместо удаления пересекающихся боксов снижает их
+    score на exp(-IoU^2 / sigma). Возвращает (индексы, новые score) боксов,
+    у которых score не упал ниже min_score, по убыванию исходного выбора.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).copy()
+    n = len(boxes)
+    if n == 0:
+        return np.zeros(0, dtype=int), np.zeros(0)
+
+    ious = iou_matrix(boxes, boxes)
+    alive = np.ones(n, dtype=bool)
+    keep, kept_scores = [], []
+
+    while alive.any():
+        i = int(np.flatnonzero(alive)[np.argmax(scores[alive])])
+        if scores[i] < min_score:
+            break
+        keep.append(i)
+        kept_scores.append(scores[i])
+        alive[i] = False
+        scores[alive] *= np.exp(-(ious[i, alive] ** 2) / sigma)
+
+    return np.array(keep, dtype=int), np.array(kept_scores)
+
+
+def weighted_box_fusion(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_thresh: float,
+    n_sources: int = 2,
+) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+    """
+    Weighted Box Fusion: пересекающиеся боксы (IoU > iou_thresh с текущим
+    слитым боксом) объединяются в один с координатами, усреднёнными с весами
+    score. Score кластера — средний score * min(размер, n_sources) / n_sources,
+    т.е. бокс, найденный обоими детекторами, весит больше одиночного.
+
+    Возвращает (слитые боксы xywh, их score, индексы исходных боксов по кластерам).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(boxes) == 0:
+        return np.zeros((0, 4)), np.zeros(0), []
+
+    order = np.argsort(-scores, kind="stable")
+    clusters: List[List[int]] = []
+    fused = np.zeros((0, 4))
+
+    for i in order:
+        if len(fused):
+            ious = iou_matrix(boxes[i:i + 1], fused)[0]
+            best = int(np.argmax(ious))
+            if ious[best] > iou_thresh:
+                clusters[best].append(int(i))
+                members = clusters[best]
+                w = scores[members]
+                fused[best] = (boxes[members] * w[:, None]).sum(axis=0) / w.sum()
+                continue
+        clusters.append([int(i)])
+        fused = np.vstack([fused, boxes[i]])
+
+    fused_scores = np.array([
+        scores[m].mean() * min(len(m), n_sources) / n_sources for m in clusters
+    ])
+    return fused, fused_scores, [np.array(m, dtype=int) for m in clusters]
+
+
+def overlap_flags(a: np.ndarray, b: np.ndarray, iou_thresh: float) -> np.ndarray:
+    """(N,) bool: есть ли у бокса a[i] хотя бы один бокс из b с IoU > iou_thresh."""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros(len(a), dtype=bool)
+
+    if len(a) * len(b) <= DENSE_PAIRS:
+        return (iou_matrix(a, b) > iou_thresh).any(axis=1)
+
+    qi, qj = GridIndex(b).candidate_pairs(a)
+    flags = np.zeros(len(a), dtype=bool)
+    hit = pair_iou(a[qi], b[qj]) > iou_thresh
+    flags[qi[hit]] = True
+    return flags
+
+
+def _candidate_pairs(boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Пары i < j, которые могут пересекаться: все пары или через сетку для плотных страниц."""
+    n = len(boxes)
+    if n * n <= DENSE_PAIRS:
+        return np.triu_indices(n, k=1)
+    qi, qj = GridIndex(boxes).candidate_pairs(boxes)
+    mask = qi < qj
+    return qi[mask], qj[mask]
+
+
+def overlap_groups(boxes: np.ndarray, min_span_overlap: float = 0.0) -> List[np.ndarray]:
+    """
+    Связные группы боксов: пара связана, если боксы пересекаются по площади и
+    (при min_span_overlap > 0) их проекции на x или на y перекрываются не меньше
+    чем на min_span_overlap длины более короткой. Группы — в порядке первого
+    бокса, индексы внутри — по возрастанию.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    n = len(boxes)
+    parent = np.arange(n)
+    if n > 1:
+        qi, qj = _candidate_pairs(boxes)
+        a, b = to_xyxy(boxes[qi]), to_xyxy(boxes[qj])
+        inter_w = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+        inter_h = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+        linked = (inter_w > 0) & (inter_h > 0)
+        if min_span_overlap > 0:
+            span_x = inter_w / (np.minimum(a[:, 2] - a[:, 0], b[:, 2] - b[:, 0]) + 1e-6)
+            span_y = inter_h / (np.minimum(a[:, 3] - a[:, 1], b[:, 3] - b[:, 1]) + 1e-6)
+            linked &= np.maximum(span_x, span_y) >= min_span_overlap
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in zip(qi[linked].tolist(), qj[linked].tolist()):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+        parent = np.array([find(i) for i in range(n)])
+
+    groups: Dict[int, List[int]] = {}
+    for i, root in enumerate(parent.tolist()):
+        groups.setdefault(root, []).append(i)
+    return [np.array(g, dtype=int) for g in groups.values()]
+
+
+def enclosing_boxes(boxes: np.ndarray, groups: List[np.ndarray]) -> np.ndarray:
+    """(len(groups), 4) xywh: охватывающий прямоугольник каждой группы."""
+    xyxy = to_xyxy(boxes)
+    out = np.array(
+        [[*xyxy[g, :2].min(axis=0), *xyxy[g, 2:].max(axis=0)] for g in groups], dtype=np.float64
+    ).reshape(-1, 4)
+    out[:, 2:] -= out[:, :2]
+    return out
@@ -0,0 +1,201 @@
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from . import box_ops
+from .preprocess import InputSizePolicy, input_size_policy
+from .qr_detector import QrDetector
+from .stamp_detectop import StampDetector
+from utils.timing_utils import NULL_TIMER
+
+# модели, для которых имеет смысл грубый проход: крупные контрастные объекты
+CASCADE_MODELS = ("stamp", "qr")
+
+# решения по (странице, модели)
+SKIPPED = "skipped"   # грубый проход ничего не нашёл — полного прохода нет
+REGIONS = "regions"   # полный проход только по областям вокруг кандидатов
+FULL = "full"         # неуверенный кандидат или большие области — вся страница
+
+
+class CoarseToFineCascade:
+    """
+    Каскад для печатей и QR: сначала дешёвый проход той же моделью на малом
+    разрешении (coarse_size), дальше полное разрешение только там, где нужно.
+
+    По кандидатам грубого прохода (score >= candidate_conf) на каждую страницу:
+      - кандидатов нет                      -> SKIPPED, детекций нет;
+      - все увереннее confident_conf        -> REGIONS: вокруг кандидатов
+        вырезаются области с полем region_pad, приводятся к масштабу полного
+        прохода (img_size на длинную сторону страницы) и прогоняются моделью;
+      - есть неуверенный кандидат или области занимают больше max_region_area
+        страницы                            -> FULL, обычный проход по странице.
+
+    Детекции REGIONS — в координатах страницы, с порогами полного прохода;
+    дальше они идут через тот же NMS и stamp_with_signature, что и обычные.
+    Страницы без кандидатов — это и есть выигрыш и риск каскада: recall
+    теряется там, где грубый проход пропускает объект (см. stats()).
+    """
+
+    def __init__(self, paths: Dict[str, str], inf_cfg, cascade_cfg, warmup: bool = False, timer=None):
+        self.models = [m for m in cascade_cfg.get("models", list(CASCADE_MODELS)) if m in CASCADE_MODELS]
+        self.coarse_size = cascade_cfg.get("coarse_size", 512)
+        self.candidate_conf = cascade_cfg.get("candidate_conf", 0.1)
+        self.confident_conf = cascade_cfg.get("confident_conf", 0.5)
+        self.region_pad = cascade_cfg.get("region_pad", 0.25)
+        self.max_region_area = cascade_cfg.get("max_region_area", 0.4)
+        self.crop_batch_size = inf_cfg.get("crop_batch_size", 16)
+        self.img_size = inf_cfg["img_size"]
+        self.timer = timer or NULL_TIMER
+
+        stride = inf_cfg.get("input_size", {}).get("stride", 32)
+        classes = {"stamp": StampDetector, "qr": QrDetector}
+
+        # веса те же, что у постраничных детекторов (общий model_registry)
+        self.coarse = {}
+        self.refine = {}
+        for name in self.models:
+            self.coarse[name] = classes[name](
+                paths[name],
+                img_size=self.coarse_size,
+                conf_threshold=self.candidate_conf,
+                iou_threshold=inf_cfg["iou_nms"][name],
+                warmup=warmup,
+                input_policy=input_size_policy(inf_cfg, self.coarse_size),
+            )
+            # области уже в масштабе полного прохода: вход = размер области (adaptive)
+            self.refine[name] = classes[name](
+                paths[name],
+                img_size=self.img_size,
+                conf_threshold=inf_cfg["conf_threshold"][name],
+                iou_threshold=inf_cfg["iou_nms"][name],
+                input_policy=InputSizePolicy(self.img_size, mode="adaptive", stride=stride, min_size=2 * stride),
+            )
+
+        self._lock = threading.Lock()
+        self.decisions = {name: {SKIPPED: 0, REGIONS: 0, FULL: 0} for name in self.models}
+        self.regions = {name: 0 for name in self.models}
+
+    def close(self) -> None:
+        for det in list(self.coarse.values()) + list(self.refine.values()):
+            det.close()
+
+    def run(self, images: List[np.ndarray], plans: List[Set[str]]) -> Tuple[List[Set[str]], Dict[str, List]]:
+        """
+        Каскад по пачке страниц.
+        Возвращает (plans без моделей, решённых каскадом, {модель: детекции на
+        страницу или None — страница идёт в обычный полный проход}).
+        """
+        plans = [set(plan) for plan in plans]
+        outputs: Dict[str, List[Optional[List[Dict]]]] = {}
+
+        for name in self.models:
+            idxs = [i for i, plan in enumerate(plans) if name in plan]
+            outputs[name] = [None] * len(images)
+            if not idxs:
+                continue
+
+            with self.timer.stage(f"predict.{name}_coarse", pages=len(idxs)):
+                coarse = self.coarse[name].predict_batch([images[i] for i in idxs])
+
+            regions: Dict[int, List[List[int]]] = {}
+            for i, candidates in zip(idxs, coarse):
+                decision, boxes = self._decide(images[i], candidates)
+                with self._lock:
+                    self.decisions[name][decision] += 1
+                    self.regions[name] += len(boxes)
+                if decision == FULL:
+                    continue
+                plans[i].discard(name)
+                outputs[name][i] = []
+                if decision == REGIONS:
+                    regions[i] = boxes
+
+            if regions:
+                with self.timer.stage(f"predict.{name}_regions", pages=len(regions)):
+                    for i, dets in self._predict_regions(name, images, regions).items():
+                        outputs[name][i] = dets
+
+        return plans, outputs
+
+    def _decide(self, image: np.ndarray, candidates: List[Dict]) -> Tuple[str, List[List[int]]]:
+        if not candidates:
+            return SKIPPED, []
+        if any(c["score"] < self.confident_conf for c in candidates):
+            return FULL, []
+
+        h, w = image.shape[:2]
+        boxes = _merge_regions([_pad_box(c["bbox"], self.region_pad, w, h) for c in candidates])
+        area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in boxes)
+        if area > self.max_region_area * w * h:
+            return FULL, []
+        return REGIONS, boxes
+
+    def _predict_regions(self, name: str, images: List[np.ndarray], regions: Dict[int, List[List[int]]]):
+        """Области всех страниц пачки разом; боксы — обратно в координаты страниц."""
+        crops: List[np.ndarray] = []
+        owners: List[Tuple[int, int, int, float]] = []
+        for i, boxes in regions.items():
+            h, w = images[i].shape[:2]
+            # тот же масштаб, что у полного прохода по странице
+            r = self.img_size / max(h, w)
+            for x1, y1, x2, y2 in boxes:
+                crop = images[i][y1:y2, x1:x2]
+                size = (max(1, round((x2 - x1) * r)), max(1, round((y2 - y1) * r)))
+                interp = cv2.INTER_AREA if r < 1 else cv2.INTER_LINEAR
+                crops.append(cv2.resize(crop, size, interpolation=interp))
+                owners.append((i, x1, y1, r))
+
+        results = self.refine[name].predict_batch(crops, batch_size=self.crop_batch_size)
+
+        outputs: Dict[int, List[Dict]] = {i: [] for i in regions}
+        for (i, x1, y1, r), dets in zip(owners, results):
+            for det in dets:
+                x, y, bw, bh = det["bbox"]
+                det["bbox"] = [x / r + x1, y / r + y1, bw / r, bh / r]
+                outputs[i].append(det)
+        return outputs
+
+    def stats(self) -> Dict:
+        with self._lock:
+            decisions = {name: dict(d) for name, d in self.decisions.items()}
+            regions = dict(self.regions)
+        avoided = {name: d[SKIPPED] + d[REGIONS] for name, d in decisions.items()}
+        screened = sum(sum(d.values()) for d in decisions.values())
+        return {
+            "decisions": decisions,
+            "regions": regions,
+            "full_passes_avoided": avoided,
+            "full_passes_avoided_total": sum(avoided.values()),
+            "pages_screened": screened,
+        }
+
+
+def _pad_box(bbox, pad: float, w: int, h: int) -> List[int]:
+    """[x, y, w, h] -> [x1, y1, x2, y2] с полем pad от стороны бокса, в границах страницы."""
+    x, y, bw, bh = bbox
+    px, py = bw * pad, bh * pad
+    return [
+        max(0, int(x - px)),
+        max(0, int(y - py)),
+        min(w, int(np.ceil(x + bw + px))),
+        min(h, int(np.ceil(y + bh + py))),
+    ]
+
+
+def _merge_regions(boxes: List[List[int]]) -> List[List[int]]:
+    """
+    Пересекающиеся области склеиваются в охватывающий прямоугольник; повторяем,
+    пока склеенные не перестанут пересекаться (пары — через box_ops.overlap_groups).
+    """
+    boxes = [b for b in boxes if b[2] > b[0] and b[3] > b[1]]
+    if not boxes:
+        return []
+    xyxy = np.array(boxes, dtype=np.int64)
+    while True:
+        xywh = np.concatenate([xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2]], axis=1)
+        groups = box_ops.overlap_groups(xywh)
+        if len(groups) == len(xyxy):
+            return xyxy.tolist()
+        xyxy = np.array([[*xyxy[g, :2].min(axis=0), *xyxy[g, 2:].max(axis=0)] for g in groups])
@@ -1,13 +1,19 @@
-from typing import List, Dict
+from typing import Iterable, List, Dict, Optional, Union
 from pathlib import Path
-import os
-import tempfile
+import threading
 
-from PIL import Image
+import cv2
+import numpy as np
 
 from .signature_detector import SignatureDetector
 from .stamp_detectop import StampDetector
 from .qr_detector import QrDetector
+from .preprocess import boxes_to_page, input_size_policy, letterbox_batch
+from . import box_ops
+from .triage import PAGE_MODELS, PageTriage
+from .cascade import CoarseToFineCascade
+from .backends import resolve_model_path
+from utils.timing_utils import NULL_TIMER
 
 
 def bbox_iou_xywh(b1, b2) -> float:
@@ -38,34 +44,133 @@ def nms_per_class(dets: List[Dict], iou_thresh: float) -> List[Dict]:
     if not dets:
         return []
 
-    dets_sorted = sorted(dets, key=lambda d: d["score"], reverse=True)
-    kept = []
+    boxes = np.array([d["bbox"] for d in dets], dtype=np.float64)
+    scores = np.array([d["score"] for d in dets], dtype=np.float64)
+    keep = box_ops.nms(boxes, scores, iou_thresh)
+    return [dets[i] for i in keep]
+
+
+def soft_nms_per_class(dets: List[Dict], sigma: float, min_score: float) -> List[Dict]:
+    if not dets:
+        return []
+
+    boxes = np.array([d["bbox"] for d in dets], dtype=np.float64)
+    scores = np.array([d["score"] for d in dets], dtype=np.float64)
+    keep, new_scores = box_ops.soft_nms(boxes, scores, sigma=sigma, min_score=min_score)
 
-    while dets_sorted:
-        best = dets_sorted.pop(0)
-        kept.append(best)
-        dets_sorted = [
-            d
-            for d in dets_sorted
-            if bbox_iou_xywh(best["bbox"], d["bbox"]) < iou_thresh
-        ]
+    kept = []
+    for i, score in zip(keep, new_scores):
+        det = dets[i].copy()
+        det["score"] = float(score)
+        kept.append(det)
     return kept
 
 
+def wbf_per_class(dets: List[Dict], iou_thresh: float, n_sources: int = 2) -> List[Dict]:
+    if not dets:
+        return []
+
+    boxes = np.array([d["bbox"] for d in dets], dtype=np.float64)
+    scores = np.array([d["score"] for d in dets], dtype=np.float64)
+    fused, fused_scores, clusters = box_ops.weighted_box_fusion(
+        boxes, scores, iou_thresh, n_sources=n_sources
+    )
+
+    merged = []
+    for box, score, members in zip(fused, fused_scores, clusters):
+        # за основу берём самый уверенный бокс кластера (category, source)
+        det = dets[members[0]].copy()
+        det["bbox"] = [float(v) for v in box]
+        det["score"] = float(score)
+        merged.append(det)
+    return merged
+
+
+def merge_tile_fragments(dets: List[Dict], span_overlap: float = 0.5) -> List[Dict]:
+    """
+    Склейка кусков объекта, разрезанного швом тайлов (tile_cut, см. PageTile).
+    Куски одной категории пересекаются в полосе перекрытия и совпадают по
+    другой оси (проекции перекрываются не меньше чем на span_overlap более
+    короткой); связная группа таких кусков (box_ops.overlap_groups) заменяется
+    охватывающим боксом с лучшим score, дальше он идёт в общий NMS.
+    """
+    merged = [d for d in dets if not d.get("tile_cut")]
+    parts = [d for d in dets if d.get("tile_cut")]
+    if not parts:
+        return merged
+
+    by_category: Dict[str, List[Dict]] = {}
+    for det in parts:
+        by_category.setdefault(det["category"], []).append(det)
+
+    for group_dets in by_category.values():
+        boxes = np.array([d["bbox"] for d in group_dets], dtype=np.float64)
+        groups = box_ops.overlap_groups(boxes, span_overlap)
+        for group, box in zip(groups, box_ops.enclosing_boxes(boxes, groups)):
+            best = max(group.tolist(), key=lambda k: group_dets[k]["score"])
+            det = {k: v for k, v in group_dets[best].items() if k != "tile_cut"}
+            det["bbox"] = [float(v) for v in box]
+            merged.append(det)
+    return merged
+
+
 class EnsembleDetector:
-    def __init__(self, cfg):
-        paths = cfg["paths"]["models"]
+    def __init__(self, cfg, cache=None, timer=None, dedup=None):
+        """
+        cache — необязательный кэш детекций (utils.cache_utils.DetectionCache):
+        при попадании страница не проходит ни через один детектор.
+        dedup — необязательный индекс почти одинаковых страниц
+        (utils.dedup_utils.PageDedupIndex): проверяется после промаха кэша,
+        при совпадении берутся детекции ранее обработанной страницы.
+        timer — необязательный utils.timing_utils.StageTimer: время загрузки моделей,
+        triage, препроцессинга, predict каждой модели, crop-прохода и NMS.
+        """
+        # веса с учётом inference.backend: .pt, .onnx или OpenVINO (см. backends.py)
+        paths = {name: resolve_model_path(cfg, name) for name in cfg["paths"]["models"]}
         inf_cfg = cfg["inference"]
 
         self.iou_nms = inf_cfg["iou_nms"]
         self.stamp_with_signature_iou = inf_cfg["stamp_with_signature_iou"]
-
+        # как склеивать подписи глобального и crop-детектора: nms | soft_nms | wbf
+        self.signature_merge = inf_cfg.get("signature_merge", "nms")
+        self.soft_nms_sigma = inf_cfg.get("soft_nms_sigma", 0.5)
+        self.soft_nms_min_score = inf_cfg.get("soft_nms_min_score", 0.15)
+        warmup = inf_cfg.get("warmup", True)
+        self.batch_size = inf_cfg.get("batch_size", 1)
+        self.crop_batch_size = inf_cfg.get("crop_batch_size", 16)
+        self.shared_preprocess = inf_cfg.get("shared_preprocess", True)
+        self.cache = cache
+        self.dedup = dedup
+        self.timer = timer or NULL_TIMER
+
+        # дешёвая сортировка страниц: какие детекторы запускать (None — все на всех)
+        triage_cfg = cfg.get("triage", {})
+        self.triage = PageTriage(triage_cfg) if triage_cfg.get("enabled", False) else None
+        self.cascade = None
+
+        # predictor'ы ultralytics не потокобезопасны: инференс из разных
+        # потоков (API, конвейер) выполняется по очереди
+        self._lock = threading.RLock()
+
+        # все детекторы берут модели из общего реестра (model_registry):
+        # signature_global и signature_in_stamp делят одни и те же веса
+        with self.timer.stage("model_load", pages=0):
+            self._load_detectors(paths, inf_cfg, warmup)
+
+            # грубый проход для печатей / QR перед полным разрешением (None — выключен)
+            cascade_cfg = cfg.get("cascade", {})
+            if cascade_cfg.get("enabled", False):
+                self.cascade = CoarseToFineCascade(paths, inf_cfg, cascade_cfg, warmup=warmup, timer=self.timer)
+
+    def _load_detectors(self, paths: Dict[str, str], inf_cfg, warmup: bool) -> None:
         #ДЕТЕКТОР ПОДПИСИ НА ВСЕЙ СТРАНИЦЕ
         self.signature_global = SignatureDetector(
             paths["signature"],
             img_size=inf_cfg["img_size"],
+            input_policy=input_size_policy(inf_cfg, inf_cfg["img_size"]),
             conf_threshold=inf_cfg["conf_threshold"]["signature_global"],
             iou_threshold=inf_cfg["iou_nms"]["signature"],
+            warmup=warmup,
         )
 
         #ДЕТЕКТОР ПОДПИСИ НА CROP ПЕЧАТИ
@@ -73,103 +178,354 @@ class EnsembleDetector:
         self.signature_in_stamp = SignatureDetector(
             paths["signature"],
             img_size=inf_cfg.get("img_size_stamp", 512),
+            input_policy=input_size_policy(inf_cfg, inf_cfg.get("img_size_stamp", 512)),
             conf_threshold=inf_cfg["conf_threshold"]["signature_in_stamp"],
             iou_threshold=inf_cfg["iou_nms"]["signature"],
+            warmup=warmup,
         )
 
         #ДЕТЕКТОР ПЕЧАТЕЙ
         self.stamp = StampDetector(
             paths["stamp"],
             img_size=inf_cfg["img_size"],
+            input_policy=input_size_policy(inf_cfg, inf_cfg["img_size"]),
             conf_threshold=inf_cfg["conf_threshold"]["stamp"],
             iou_threshold=inf_cfg["iou_nms"]["stamp"],
+            warmup=warmup,
         )
 
         #ДЕТЕКТОР QR
         self.qr = QrDetector(
             paths["qr"],
             img_size=inf_cfg["img_size"],
+            input_policy=input_size_policy(inf_cfg, inf_cfg["img_size"]),
             conf_threshold=inf_cfg["conf_threshold"]["qr"],
             iou_threshold=inf_cfg["iou_nms"]["qr"],
+            warmup=warmup,
         )
 
+    def close(self) -> None:
+        """Отдаёт все модели обратно в реестр (выгружаются, когда ссылок больше нет)."""
+        for det in (self.signature_global, self.signature_in_stamp, self.stamp, self.qr):
+            det.close()
+        if self.cascade is not None:
+            self.cascade.close()
+
     #ВСПОМОГАТЕЛЬНОЕ: ДЕТЕКТ ПОДПИСЕЙ ВНУТРИ PEЧАТЕЙ
 
     def _detect_signatures_inside_stamps(
         self,
-        image_path: str,
-        stamps: List[Dict],
-    ) -> List[Dict]:
+        images: List[np.ndarray],
+        stamps_per_page: List[List[Dict]],
+    ) -> List[List[Dict]]:
+        """
+        Второй проход по печатям сразу для пачки страниц:
+          - собираем crop'ы всех печатей со всех страниц (срезы массивов, без временных файлов)
+          - прогоняем их через signature_in_stamp батчами по crop_batch_size
+          - одним векторным шагом переносим bbox подписей в координаты страниц
+        """
+        sigs_per_page: List[List[Dict]] = [[] for _ in images]
+
+        crops: List[np.ndarray] = []
+        crop_page: List[int] = []
+        crop_offset: List[List[int]] = []
+
+        for page_idx, (image, stamps) in enumerate(zip(images, stamps_per_page)):
+            if not stamps:
+                continue
+            h_img, w_img = image.shape[:2]
+
+            #аккуратно приводим к int и обрезаем границы (для всех печатей страницы сразу)
+            xywh = np.array([st["bbox"] for st in stamps], dtype=np.float64)
+            x1 = np.maximum(0, xywh[:, 0].astype(int))
+            y1 = np.maximum(0, xywh[:, 1].astype(int))
+            x2 = np.minimum((xywh[:, 0] + xywh[:, 2]).astype(int), w_img)
+            y2 = np.minimum((xywh[:, 1] + xywh[:, 3]).astype(int), h_img)
+
+            for cx1, cy1, cx2, cy2 in zip(x1, y1, x2, y2):
+                if cx2 <= cx1 or cy2 <= cy1:
+                    continue
+                crops.append(np.ascontiguousarray(image[cy1:cy2, cx1:cx2]))
+                crop_page.append(page_idx)
+                crop_offset.append([int(cx1), int(cy1)])
+
+        if not crops:
+            return sigs_per_page
+
+        # «страницы» этой стадии — crop'ы печатей
+        with self.timer.stage("predict.signature_in_stamp", pages=len(crops)):
+            local_sigs = self.signature_in_stamp.predict_batch(
+                crops, batch_size=self.crop_batch_size
+            )
+
+        #раскладываем детекции в плоские массивы: bbox, индекс crop'а
+        flat = [(ci, sg) for ci, sigs in enumerate(local_sigs) for sg in sigs]
+        if not flat:
+            return sigs_per_page
+
+        crop_idx = np.array([ci for ci, _ in flat], dtype=int)
+        boxes = np.array([sg["bbox"] for _, sg in flat], dtype=np.float64)
+
+        #переносим координаты в глобальные
+        boxes[:, :2] += np.asarray(crop_offset, dtype=np.float64)[crop_idx]
+
+        for (ci, sg), box in zip(flat, boxes.tolist()):
+            sg_global = sg.copy()
+            sg_global["bbox"] = box
+            sg_global["source"] = "signature_in_stamp"
+            sigs_per_page[crop_page[ci]].append(sg_global)
+
+        return sigs_per_page
+
+    #ОСНОВНЫЕ МЕТОДЫ
+
+    @staticmethod
+    def _as_image(page) -> np.ndarray:
+        """
+        page — путь до картинки, уже декодированная страница (np.ndarray BGR)
+        или объект страницы с атрибутом .image (utils.pds_utils.PdfPage).
+        Путь декодируем один раз, дальше все детекторы работают с массивом.
         """
-        Для каждой печати:
-          - делаем crop
-          - прогоняем signature_in_stamp
-          - переносим bbox подписи обратно в координаты страницы
+        if hasattr(page, "image"):
+            return page.image
+        if isinstance(page, (str, Path)):
+            path = str(page)
+            image = cv2.imread(path)
+            if image is None:
+                raise ValueError(f"Failed to read image: {path}")
+            return image
+        return page
+
+    def detect_on_image(self, image: Union[str, np.ndarray]) -> List[Dict]:
+        return self.detect_on_pages([image], batch_size=1)[0]
+
+    def detect_on_pages(
+        self,
+        pages: Iterable,
+        batch_size: Optional[int] = None,
+    ) -> List[List[Dict]]:
         """
-        if not stamps:
-            return []
+        Батчевая детекция: страницы идут пачками по batch_size через
+        stamp / qr / signature_global — один model.predict на пачку,
+        дальше результаты раскладываются обратно по страницам.
 
-        img = Image.open(image_path).convert("RGB")
-        h_img, w_img = img.size[1], img.size[0]  # (w, h) -> (h, w) если надо
+        :param pages: пути, np.ndarray (BGR) или PdfPage
+        :param batch_size: размер пачки (None — inference.batch_size из конфига)
+        :return: список детекций на каждую страницу в исходном порядке
+        """
+        pages = list(pages)
+        images = [self._as_image(p) for p in pages]
+        batch_size = batch_size or self.batch_size
+
+        if self.cache is None and self.dedup is None:
+            return self._detect_fresh(pages, images, batch_size)
+
+        all_dets: List[Optional[List[Dict]]] = [None] * len(images)
+        keys: List[Optional[str]] = [None] * len(images)
+        if self.cache is not None:
+            with self.timer.stage("cache_lookup", pages=len(images)):
+                keys = [self.cache.key(img) for img in images]
+                all_dets = [self.cache.get(k) for k in keys]
+        misses = [i for i, dets in enumerate(all_dets) if dets is None]
+
+        if self.dedup is not None and misses:
+            with self.timer.stage("dedup_lookup", pages=len(misses)):
+                misses = self._dedup_lookup(pages, images, misses, all_dets)
+
+        if misses:
+            fresh = self._detect_fresh([pages[i] for i in misses], [images[i] for i in misses], batch_size)
+            for i, dets in zip(misses, fresh):
+                if self.cache is not None:
+                    self.cache.put(keys[i], dets)
+                if self.dedup is not None:
+                    self.dedup.add(images[i], dets, source=self._page_source(pages[i]))
+                all_dets[i] = dets
 
-        sigs_from_crops: List[Dict] = []
+        return all_dets
 
-        for idx, st in enumerate(stamps):
-            x, y, w, h = st["bbox"]
-            #аккуратно приводим к int и обрезаем границы
-            x1 = max(0, int(x))
-            y1 = max(0, int(y))
-            x2 = min(int(x + w), w_img)
-            y2 = min(int(y + h), h_img)
+    @staticmethod
+    def _page_source(page) -> Optional[str]:
+        """«документ:страница» для PdfPage (для провенанса в dedup), иначе None."""
+        doc_name = getattr(page, "doc_name", None)
+        page_num = getattr(page, "page_num", None)
+        if doc_name is None or page_num is None:
+            return None
+        return f"{doc_name}:{page_num}"
 
-            if x2 <= x1 or y2 <= y1:
+    def _dedup_lookup(self, pages, images, misses, all_dets) -> List[int]:
+        """
+        Заполняет all_dets найденными в dedup страницами, возвращает оставшиеся промахи.
+        В точный кэш такие детекции не пишутся: они приближённые (взяты у похожей
+        страницы) и не должны стать записью под хэшем пикселей этой страницы.
+        """
+        remaining = []
+        for i in misses:
+            found = self.dedup.lookup(images[i])
+            if found is None:
+                remaining.append(i)
                 continue
+            dets, provenance = found
+            all_dets[i] = dets
+            # откуда взяты детекции — виден у PdfPage (попадает в результат страницы)
+            if hasattr(pages[i], "dedup_of"):
+                pages[i].dedup_of = provenance
+        return remaining
+
+    def _detect_fresh(self, pages, images: List[np.ndarray], batch_size: int) -> List[List[Dict]]:
+        """Детекция моделями: большие листы (page.tiles) — по тайлам, остальные — пачками."""
+        results: List[Optional[List[Dict]]] = [None] * len(images)
+        tiled = [i for i, page in enumerate(pages) if getattr(page, "tiles", None) is not None]
+        plain = sorted(set(range(len(images))) - set(tiled))
+
+        if plain:
+            with self._lock:
+                fresh = self._detect_batches([images[i] for i in plain], batch_size)
+            for i, dets in zip(plain, fresh):
+                results[i] = dets
+
+        for i in tiled:
+            results[i] = self._detect_tiled(pages[i], images[i])
+        return results
+
+    def _detect_batches(self, images: List[np.ndarray], batch_size: int) -> List[List[Dict]]:
+        all_dets: List[List[Dict]] = []
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            sigs_global, sigs_from_crops, stamps, qrs = self._detect_raw(chunk)
+
+            with self.timer.stage("nms", pages=len(chunk)):
+                for i in range(len(chunk)):
+                    all_dets.append(
+                        self._merge_page(sigs_global[i], sigs_from_crops[i], stamps[i], qrs[i])
+                    )
 
-            crop = img.crop((x1, y1, x2, y2))
-
-            #временный файл для вторичного детектора
-            with tempfile.NamedTemporaryFile(
-                suffix=".png", delete=False
-            ) as tmp:
-                crop_path = tmp.name
-                crop.save(crop_path)
-
-            local_sigs = self.signature_in_stamp.predict(crop_path)
-
-            #очистим временный файл
-            try:
-                os.remove(crop_path)
-            except OSError:
-                pass
-
-            #переносим координаты в глобальные
-            for sg in local_sigs:
-                lx, ly, lw, lh = sg["bbox"]
-                gx = lx + x1
-                gy = ly + y1
-                sg_global = sg.copy()
-                sg_global["bbox"] = [gx, gy, lw, lh]
-                sg_global["source"] = "signature_in_stamp"
-                sigs_from_crops.append(sg_global)
-
-        return sigs_from_crops
-
-    #ОСНОВНОЙ МЕТОД 
-
-    def detect_on_image(self, image_path: str) -> List[Dict]:
-        #базовые детекциями
-        sigs_global = self.signature_global.predict(image_path)
-        stamps = self.stamp.predict(image_path)
-        qrs = self.qr.predict(image_path)
-
-        #подписи внутри печатей (второй проход)
-        sigs_from_crops = self._detect_signatures_inside_stamps(
-            image_path, stamps
-        )
+        return all_dets
+
+    def _detect_tiled(self, page, image: np.ndarray) -> List[Dict]:
+        """
+        Большой лист по тайлам (utils.pds_utils.PageTiles): тайлы при tiling.dpi
+        идут пачками через те же модели и crop-проход, боксы переводятся в
+        координаты страницы, куски объектов, разрезанных швом, склеиваются
+        (merge_tile_fragments), и весь лист один раз проходит общий NMS и
+        stamp_with_signature. full_page_pass — ещё и обычный проход по странице
+        целиком: крупные печати / QR, которые не влезли ни в один тайл.
+        """
+        tiles = page.tiles
+        raw: List[List[Dict]] = [[], [], [], []]
+
+        if tiles.full_page_pass:
+            with self._lock:
+                for part, found in zip(raw, self._detect_raw([image])):
+                    part.extend(found[0])
+
+        for batch in tiles.iter_batches(timer=self.timer):
+            with self._lock:
+                found = self._detect_raw([tile.image for tile in batch])
+            for k, tile in enumerate(batch):
+                for part, per_tile in zip(raw, found):
+                    # тайл -> page_size -> пиксели image (для скана со своим разрешением)
+                    mapped = tile.to_page_coords(per_tile[k], tiles.edge_margin)
+                    part.extend(page.to_image_coords(mapped))
+
+        with self.timer.stage("nms"):
+            return self._merge_page(*(merge_tile_fragments(part) for part in raw))
+
+    def _detect_raw(self, chunk: List[np.ndarray]):
+        """Сырые детекции пачки картинок до склейки: (подписи, подписи из печатей, печати, QR)."""
+        #какие модели нужны каждой странице (triage может отсеять пустые / текстовые)
+        if self.triage is not None:
+            with self.timer.stage("triage", pages=len(chunk)):
+                plans = [self.triage.plan(img) for img in chunk]
+        else:
+            plans = [set(PAGE_MODELS) for _ in chunk]
+
+        #каскад: печати / QR, решённые грубым проходом, убираются из плана полного
+        cascaded = {}
+        if self.cascade is not None:
+            plans, cascaded = self.cascade.run(chunk, plans)
+
+        #базовые детекции — по одному вызову модели на пачку
+        if self.shared_preprocess:
+            sigs_global, stamps, qrs = self._predict_page_models_shared(chunk, plans)
+        else:
+            sigs_global = self._predict_planned(self.signature_global, "signature", chunk, plans)
+            stamps = self._predict_planned(self.stamp, "stamp", chunk, plans)
+            qrs = self._predict_planned(self.qr, "qr", chunk, plans)
+
+        for name, per_page in cascaded.items():
+            full = stamps if name == "stamp" else qrs
+            for i, dets in enumerate(per_page):
+                if dets is not None:
+                    full[i] = dets
+
+        #подписи внутри печатей (второй проход) — все crop'ы пачки разом
+        with self.timer.stage("crop_pass", pages=len(chunk)):
+            sigs_from_crops = self._detect_signatures_inside_stamps(chunk, stamps)
+
+        return sigs_global, sigs_from_crops, stamps, qrs
+
+    def _predict_planned(self, detector, name: str, images: List[np.ndarray], plans) -> List[List[Dict]]:
+        """predict_batch только по страницам, которым эта модель нужна."""
+        outputs: List[List[Dict]] = [[] for _ in images]
+        idxs = [i for i, plan in enumerate(plans) if name in plan]
+        if idxs:
+            with self.timer.stage(f"predict.{name}", pages=len(idxs)):
+                results = detector.predict_batch([images[i] for i in idxs])
+            for i, dets in zip(idxs, results):
+                outputs[i] = dets
+        return outputs
+
+    def _predict_page_models_shared(self, images: List[np.ndarray], plans):
+        """
+        Общий препроцессинг для трёх постраничных моделей: пачка страниц
+        letterbox'ится в тензор один раз на каждый img_size и форму страницы —
+        в минимальный кратный stride прямоугольник, как ultralytics делает
+        для .pt-модели сам (InputSizePolicy.shape), а не в квадрат img_size.
+        Тензор отдаётся всем моделям этого размера, а боксы одним общим
+        шагом переводятся обратно в координаты страниц.
+        Страницы, которым по plans не нужна ни одна модель, не letterbox'ятся.
+        """
+        detectors = {"signature": self.signature_global, "stamp": self.stamp, "qr": self.qr}
+
+        by_size: Dict[int, List[str]] = {}
+        for name, det in detectors.items():
+            by_size.setdefault(det.img_size, []).append(name)
+
+        outputs = {name: [[] for _ in images] for name in detectors}
+        for img_size, names in by_size.items():
+            needed = [i for i, plan in enumerate(plans) if any(n in plan for n in names)]
+            if not needed:
+                continue
 
-        #склеиваем все подписи и делаем NMS
+            # у моделей одного img_size политика общая (секция inference.input_size)
+            policy = detectors[names[0]].input_policy
+            shapes = policy.group_by_shape([images[i] for i in needed])
+            for shape, group in shapes.items():
+                group = [needed[k] for k in group]
+                with self.timer.stage("preprocess", pages=len(group)):
+                    batch, metas = letterbox_batch([images[i] for i in group], img_size, shape=shape)
+                for name in names:
+                    rows = [k for k, i in enumerate(group) if name in plans[i]]
+                    if not rows:
+                        continue
+                    with self.timer.stage(f"predict.{name}", pages=len(rows)):
+                        sub = batch if len(rows) == len(group) else batch[rows]
+                        raw = detectors[name].predict_tensor(sub)
+                        for k, dets in zip(rows, raw):
+                            outputs[name][group[k]] = boxes_to_page(dets, metas[k])
+
+        return outputs["signature"], outputs["stamp"], outputs["qr"]
+
+    def _merge_page(
+        self,
+        sigs_global: List[Dict],
+        sigs_from_crops: List[Dict],
+        stamps: List[Dict],
+        qrs: List[Dict],
+    ) -> List[Dict]:
+        #склеиваем все подписи и делаем NMS (или soft-NMS / WBF)
         sigs_all_raw = sigs_global + sigs_from_crops
-        sigs = nms_per_class(sigs_all_raw, self.iou_nms["signature"])
+        sigs = self._merge_signatures(sigs_all_raw)
 
         stamps = nms_per_class(stamps, self.iou_nms["stamp"])
         qrs = nms_per_class(qrs, self.iou_nms["qr"])
@@ -179,13 +535,25 @@ class EnsembleDetector:
 
         return all_dets
 
+    def _merge_signatures(self, sigs: List[Dict]) -> List[Dict]:
+        if self.signature_merge == "soft_nms":
+            return soft_nms_per_class(sigs, self.soft_nms_sigma, self.soft_nms_min_score)
+        if self.signature_merge == "wbf":
+            return wbf_per_class(sigs, self.iou_nms["signature"])
+        return nms_per_class(sigs, self.iou_nms["signature"])
+
     def _add_stamp_with_signature_flag(self, dets: List[Dict]) -> List[Dict]:
         stamps = [d for d in dets if d["category"] == "stamp"]
         sigs = [d for d in dets if d["category"] == "signature"]
+        if not stamps or not sigs:
+            return dets
 
-        for st in stamps:
-            for sg in sigs:
-                if bbox_iou_xywh(st["bbox"], sg["bbox"]) > self.stamp_with_signature_iou:
-                    st["stamp_with_signature"] = True
-                    break
+        flags = box_ops.overlap_flags(
+            np.array([st["bbox"] for st in stamps]),
+            np.array([sg["bbox"] for sg in sigs]),
+            self.stamp_with_signature_iou,
+        )
+        for st, flag in zip(stamps, flags):
+            if flag:
+                st["stamp_with_signature"] = True
         return dets
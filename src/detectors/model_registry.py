@@ -0,0 +1,99 @@
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from ultralytics import YOLO
+
+
+class _RegistryEntry:
+    def __init__(self, model: YOLO):
+        self.model = model
+        self.refs = 0
+        self.warmed_up = False
+
+
+class ModelRegistry:
+    """
+    Общий на процесс реестр YOLO-моделей со счётчиком ссылок.
+
+    Ключ — (абсолютный путь к весам, опции загрузки). Одни и те же веса
+    загружаются в память ровно один раз, сколько бы детекторов их ни использовало.
+    Детектор берёт модель через acquire() и обязательно отдаёт через release():
+    когда ссылок не остаётся, модель выгружается.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple, _RegistryEntry] = {}
+        # загрузка и прогрев — под замком своего ключа, а не общим:
+        # пока грузится одна модель, acquire/release остальных не ждут
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+
+    @staticmethod
+    def make_key(model_path: str, **options) -> Tuple:
+        return str(Path(model_path).resolve()), tuple(sorted(options.items()))
+
+    def acquire(
+        self,
+        model_path: str,
+        warmup_size: Optional[int] = None,
+        **options,
+    ) -> YOLO:
+        """
+        Возвращает общую модель для model_path (+ опции загрузки YOLO(...)).
+
+        :param warmup_size: если задан — один раз на модель прогоняем пустую
+                            картинку этого размера, чтобы первая реальная
+                            страница не платила за инициализацию predictor'а
+        """
+        key = self.make_key(model_path, **options)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refs += 1
+
+            if entry is None:
+                entry = _RegistryEntry(YOLO(str(model_path), **options))
+                entry.refs = 1
+                with self._lock:
+                    self._entries[key] = entry
+
+            if warmup_size and not entry.warmed_up:
+                dummy = np.zeros((warmup_size, warmup_size, 3), dtype=np.uint8)
+                entry.model.predict(source=dummy, imgsz=warmup_size, verbose=False)
+                entry.warmed_up = True
+
+            return entry.model
+
+    def release(self, model: YOLO) -> None:
+        """Отдаёт ссылку на модель; на последней ссылке модель выгружается."""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.model is model:
+                    entry.refs -= 1
+                    if entry.refs <= 0:
+                        del self._entries[key]
+                    return
+
+    def loaded(self) -> Dict[str, int]:
+        """{путь к весам: число ссылок} — для отладки и мониторинга."""
+        with self._lock:
+            return {key[0]: entry.refs for key, entry in self._entries.items()}
+
+
+# реестр по умолчанию — один на процесс
+MODEL_REGISTRY = ModelRegistry()
+
+
+def acquire_model(model_path: str, warmup_size: Optional[int] = None, **options) -> YOLO:
+    return MODEL_REGISTRY.acquire(model_path, warmup_size=warmup_size, **options)
+
+
+def release_model(model: YOLO) -> None:
+    MODEL_REGISTRY.release(model)
@@ -0,0 +1,166 @@
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+
+class LetterboxMeta:
+    """
+    Как страница попала в letterbox-тензор: масштаб и паддинг.
+    Нужно, чтобы вернуть боксы из координат тензора в координаты страницы.
+    """
+
+    def __init__(self, orig_shape: Tuple[int, int], ratio: float, pad: Tuple[int, int]):
+        self.orig_shape = orig_shape  # (h, w) исходной страницы
+        self.ratio = ratio            # во сколько раз страница масштабирована
+        self.pad = pad                # (pad_x, pad_y) слева / сверху
+
+
+def letterbox(
+    image: np.ndarray,
+    new_shape: Tuple[int, int],
+    color: int = 114,
+) -> Tuple[np.ndarray, LetterboxMeta]:
+    """
+    Масштабирует картинку с сохранением пропорций и добивает паддингом
+    до new_shape (h, w) — так же, как это делает ultralytics LetterBox.
+    """
+    h, w = image.shape[:2]
+    new_h, new_w = new_shape
+
+    r = min(new_h / h, new_w / w)
+    unpad_w, unpad_h = int(round(w * r)), int(round(h * r))
+    dw, dh = (new_w - unpad_w) / 2, (new_h - unpad_h) / 2
+
+    if (unpad_w, unpad_h) != (w, h):
+        image = cv2.resize(image, (unpad_w, unpad_h), interpolation=cv2.INTER_LINEAR)
+
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(
+        image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(color, color, color)
+    )
+
+    return image, LetterboxMeta((h, w), r, (left, top))
+
+
+INPUT_MODES = ("fixed", "rect", "adaptive")
+
+
+class InputSizePolicy:
+    """
+    Размер входа модели (h, w) для страницы данного размера.
+
+    mode:
+      - fixed    — как раньше: в модель уходит imgsz=img_size, letterbox делает
+                   ultralytics (для .pt и пачки одной формы — минимальный прямоугольник,
+                   для разных форм и экспортированных бэкендов — квадрат img_size);
+      - rect     — длинная сторона img_size, короткая — по пропорциям страницы,
+                   округлённая вверх до stride: A4 и широкие чертежи не тратят
+                   половину прогона на серый паддинг;
+      - adaptive — как rect, но длинная сторона не больше, чем у самой картинки
+                   (мелкие страницы и crop'ы не растягиваются), и не меньше min_size.
+                   Размер картинки — это размер страницы при render.dpi, так что
+                   вход подстраивается под DPI рендера / родного скана.
+
+    Страницы с одинаковым shape() можно склеить в одну пачку (см. group_by_shape).
+    shape() во всех режимах — минимальный прямоугольник; в fixed им пользуется
+    только общий letterbox ансамбля (shared_preprocess), совпадающий с
+    ultralytics для .pt-моделей на страницах одной формы.
+    """
+
+    def __init__(self, img_size: int, mode: str = "fixed", stride: int = 32, min_size: int = 320):
+        if mode not in INPUT_MODES:
+            raise ValueError(f"Unknown input size mode: {mode} (expected one of {', '.join(INPUT_MODES)})")
+        self.img_size = img_size
+        self.mode = mode
+        self.stride = stride
+        self.min_size = min(min_size, img_size)
+
+    def shape(self, h: int, w: int) -> Tuple[int, int]:
+        """
+        Минимальный прямоугольник, кратный stride, в который страница
+        вписывается с длинной стороной side, — как ultralytics LetterBox(auto=True)
+        для квадрата side x side (то же округление масштабированных сторон).
+        """
+        side = self.img_size
+        if self.mode == "adaptive":
+            side = min(self.img_size, max(self.min_size, max(h, w)))
+
+        r = side / max(h, w)
+        s = self.stride
+        return max(s, math.ceil(round(h * r) / s) * s), max(s, math.ceil(round(w * r) / s) * s)
+
+    def group_by_shape(self, images: Sequence[np.ndarray]) -> Dict[Tuple[int, int], List[int]]:
+        """{(h, w) входа: индексы картинок} в порядке первого появления."""
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for i, image in enumerate(images):
+            groups.setdefault(self.shape(*image.shape[:2]), []).append(i)
+        return groups
+
+
+def input_size_policy(inf_cfg, img_size: int) -> InputSizePolicy:
+    """Политика из секции inference.input_size config.yaml для данного img_size."""
+    size_cfg = inf_cfg.get("input_size", {})
+    return InputSizePolicy(
+        img_size,
+        mode=size_cfg.get("mode", "fixed"),
+        stride=size_cfg.get("stride", 32),
+        min_size=size_cfg.get("min_size", 320),
+    )
+
+
+def letterbox_batch(
+    images: Sequence[np.ndarray],
+    img_size: int,
+    shape: Optional[Tuple[int, int]] = None,
+) -> Tuple[torch.Tensor, List[LetterboxMeta]]:
+    """
+    Пачка BGR-страниц -> один тензор (B, 3, h, w), RGB, float 0..1.
+    shape — (h, w) входа, общий для пачки (InputSizePolicy.shape, страницы одной
+    формы); без него — квадрат img_size x img_size (калибровка, parity).
+
+    Такой тензор ultralytics принимает как есть (без своего letterbox'а),
+    поэтому его можно один раз посчитать и отдать нескольким моделям.
+    """
+    new_shape = shape or (img_size, img_size)
+    tensors = []
+    metas = []
+    for image in images:
+        padded, meta = letterbox(image, new_shape)
+        # BGR HWC -> RGB CHW
+        chw = np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1))
+        tensors.append(torch.from_numpy(chw))
+        metas.append(meta)
+
+    batch = torch.stack(tensors).float().div_(255.0)
+    return batch, metas
+
+
+def boxes_to_page(detections: List[Dict], meta: LetterboxMeta) -> List[Dict]:
+    """
+    Переводит bbox [x, y, w, h] из координат letterbox-тензора в координаты
+    исходной страницы (снимаем паддинг, делим на масштаб, обрезаем по краям).
+    """
+    if not detections:
+        return []
+
+    xywh = np.array([d["bbox"] for d in detections], dtype=np.float64)
+    xyxy = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1)
+
+    xyxy[:, [0, 2]] -= meta.pad[0]
+    xyxy[:, [1, 3]] -= meta.pad[1]
+    xyxy /= meta.ratio
+
+    h, w = meta.orig_shape
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+
+    mapped = []
+    for det, (x1, y1, x2, y2) in zip(detections, xyxy.tolist()):
+        det = det.copy()
+        det["bbox"] = [x1, y1, x2 - x1, y2 - y1]
+        mapped.append(det)
+    return mapped
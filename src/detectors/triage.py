@@ -0,0 +1,129 @@
+import threading
+from typing import Dict, Set
+
+import cv2
+import numpy as np
+
+PAGE_MODELS = ("signature", "stamp", "qr")
+
+
+class PageTriage:
+    """
+    Дешёвая сортировка страниц перед YOLO: по миниатюре страницы решаем,
+    какие из постраничных детекторов вообще имеет смысл запускать.
+
+    Сигналы (всё на уменьшенной копии страницы):
+      - ink   — доля не белых пикселей (пустая страница -> пропускаем целиком)
+      - color — доля насыщенных синих/фиолетовых пикселей (печати, подписи ручкой)
+      - qr    — число блоков с QR/штрихкод-текстурой: заполнение около 50%
+                и частые чёрно-белые переходы
+    Для ч/б сканов цвета нет вообще, поэтому там печати и подписи решаются по ink.
+    """
+
+    def __init__(self, triage_cfg: Dict):
+        self.thumb_size = triage_cfg.get("thumb_size", 512)
+        self.ink_level = triage_cfg.get("ink_level", 200)
+        self.blank_ink = triage_cfg.get("blank_ink", 0.001)
+        self.grayscale_color = triage_cfg.get("grayscale_color", 0.0001)
+
+        sig_cfg = triage_cfg.get("signature", {})
+        self.sig_min_ink = sig_cfg.get("min_ink", 0.002)
+        self.sig_require_color = sig_cfg.get("require_color", False)
+        self.sig_min_color = sig_cfg.get("min_color", 0.0002)
+
+        stamp_cfg = triage_cfg.get("stamp", {})
+        self.stamp_min_color = stamp_cfg.get("min_color", 0.00008)
+        self.stamp_grayscale_fallback = stamp_cfg.get("grayscale_fallback", True)
+
+        qr_cfg = triage_cfg.get("qr", {})
+        self.qr_block = qr_cfg.get("block", 16)
+        self.qr_min_blocks = qr_cfg.get("min_blocks", 4)
+        self.qr_min_transitions = qr_cfg.get("min_transitions", 0.2)
+
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.pages_skipped = 0
+        self.calls_saved = {name: 0 for name in PAGE_MODELS}
+
+    def signals(self, image: np.ndarray) -> Dict[str, float]:
+        h, w = image.shape[:2]
+        scale = min(1.0, self.thumb_size / max(h, w))
+        thumb = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        # тонкие штрихи на миниатюре становятся светло-серыми, поэтому «чернила» — всё не белое
+        ink = float((gray < self.ink_level).mean())
+        dark = gray < 128
+
+        hsv = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)
+        hue, sat, val = hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
+        saturated = (sat > 60) & (val > 40)
+        # синий..фиолетовый в шкале OpenCV (0..180)
+        blue_violet = saturated & (hue >= 90) & (hue <= 160)
+
+        return {
+            "ink": ink,
+            "saturated": float(saturated.mean()),
+            "color": float(blue_violet.mean()),
+            "qr": float(self._qr_blocks(dark)),
+        }
+
+    def _qr_blocks(self, dark: np.ndarray) -> int:
+        b = self.qr_block
+        h, w = (dark.shape[0] // b) * b, (dark.shape[1] // b) * b
+        if h == 0 or w == 0:
+            return 0
+        d = dark[:h, :w].astype(np.float32)
+
+        # переходы чёрное/белое по x и y, усреднённые по блокам b x b
+        tx = np.zeros_like(d)
+        ty = np.zeros_like(d)
+        tx[:, 1:] = np.abs(np.diff(d, axis=1))
+        ty[1:, :] = np.abs(np.diff(d, axis=0))
+
+        def blocks(a):
+            return a.reshape(h // b, b, w // b, b).mean(axis=(1, 3))
+
+        fill = blocks(d)
+        trans = np.maximum(blocks(tx), blocks(ty))
+        qr_like = (fill > 0.3) & (fill < 0.7) & (trans > self.qr_min_transitions)
+        return int(qr_like.sum())
+
+    def plan(self, image: np.ndarray) -> Set[str]:
+        """Какие постраничные модели запускать на этой странице (пусто — пропустить)."""
+        s = self.signals(image)
+        models: Set[str] = set()
+
+        if s["ink"] >= self.blank_ink or s["color"] >= self.stamp_min_color:
+            grayscale = s["saturated"] < self.grayscale_color
+
+            if s["ink"] >= self.sig_min_ink and (
+                not self.sig_require_color or grayscale or s["color"] >= self.sig_min_color
+            ):
+                models.add("signature")
+
+            if s["color"] >= self.stamp_min_color or (grayscale and self.stamp_grayscale_fallback):
+                models.add("stamp")
+
+            if s["qr"] >= self.qr_min_blocks:
+                models.add("qr")
+
+        with self._lock:
+            self.pages += 1
+            if not models:
+                self.pages_skipped += 1
+            for name in PAGE_MODELS:
+                if name not in models:
+                    self.calls_saved[name] += 1
+
+        return models
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pages": self.pages,
+                "pages_skipped": self.pages_skipped,
+                "calls_saved": dict(self.calls_saved),
+                "calls_saved_total": sum(self.calls_saved.values()),
+            }
@@ -0,0 +1,184 @@
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class QueueFullError(Exception):
+    """Очередь задач заполнена — API отвечает 429."""
+
+
+class Job:
+    """
+    Задача на обработку загруженных PDF.
+
+    status: queued -> running -> done | failed
+    progress: {имя документа: {"pages_total", "pages_done"}}
+    result: итоговый словарь build_results_dict (когда status == done)
+    timings: StageTimer.summary() задачи (рендер, детекция, визуализация)
+    events: лента событий для потоковой выдачи (page / document / done | failed),
+            последнее событие всегда done или failed
+    """
+
+    def __init__(self, files: List[Tuple[str, str]], workdir: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.files = files  # [(имя документа, путь к PDF)]
+        self.workdir = workdir  # папка задачи (загрузки, страницы); удаляется в on_evict
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.progress: Dict[str, Dict] = {
+            name: {"pages_total": None, "pages_done": 0} for name, _ in files
+        }
+        self.predictions: Dict[str, Dict] = {}
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.timings: Optional[Dict] = None
+        self.started_at: Optional[float] = None
+        self.future: Optional[Future] = None
+        self.events: List[Dict] = []
+        # результат уже отдан (синхронный запрос) — удалить задачу сразу по завершении
+        self.release_on_finish = False
+        self._lock = threading.Lock()
+
+    def set_total(self, doc_name: str, pages_total: int) -> None:
+        with self._lock:
+            self.progress[doc_name]["pages_total"] = pages_total
+
+    def page_done(self, doc_name: str) -> None:
+        with self._lock:
+            self.progress[doc_name]["pages_done"] += 1
+
+    def publish(self, event: Dict) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def events_since(self, index: int) -> List[Dict]:
+        """События, начиная с номера index (клиент потока держит свой курсор)."""
+        with self._lock:
+            return self.events[index:]
+
+    def to_dict(self, include_timings: bool = False) -> Dict:
+        with self._lock:
+            data = {
+                "job_id": self.id,
+                "status": self.status,
+                "progress": {name: dict(p) for name, p in self.progress.items()},
+            }
+        if self.status == "done":
+            data["result"] = self.result
+        if self.status == "failed":
+            data["error"] = self.error
+        if include_timings:
+            data["timings"] = self.timings
+        return data
+
+
+class JobManager:
+    """
+    Ограниченная очередь задач поверх пула потоков.
+
+    Одновременно выполняется max_workers задач, ещё max_queue могут ждать;
+    сверх этого submit() бросает QueueFullError. Завершённые задачи
+    хранятся job_ttl_sec секунд, чтобы клиент успел забрать результат;
+    release() удаляет задачу раньше — когда результат уже забран.
+    """
+
+    def __init__(
+        self,
+        process_job: Callable[[Job], Dict],
+        max_workers: int = 1,
+        max_queue: int = 16,
+        job_ttl_sec: float = 3600,
+        on_evict: Optional[Callable[[Job], None]] = None,
+        on_finish: Optional[Callable[[Job], None]] = None,
+    ):
+        self.process_job = process_job
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_ttl_sec = job_ttl_sec
+        self.on_evict = on_evict
+        self.on_finish = on_finish
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def pending(self) -> int:
+        """Сколько задач в очереди или в работе."""
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status in ("queued", "running"))
+
+    def submit(self, files: List[Tuple[str, str]], workdir: Optional[str] = None) -> Job:
+        self.evict_expired()
+
+        with self._lock:
+            active = sum(1 for j in self._jobs.values() if j.status in ("queued", "running"))
+            if active >= self.max_workers + self.max_queue:
+                raise QueueFullError(f"job queue is full ({active} jobs pending)")
+
+            job = Job(files, workdir)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job)
+
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def release(self, job: Job) -> None:
+        """
+        Задача больше не нужна (синхронный запрос уже ответил): завершённая
+        удаляется сразу вместе с файлами (on_evict), ещё идущая — как только закончится.
+        """
+        with self._lock:
+            if job.finished_at is None:
+                job.release_on_finish = True
+                return
+            removed = self._jobs.pop(job.id, None) is not None
+
+        if removed and self.on_evict is not None:
+            self.on_evict(job)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job) -> Dict:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = self.process_job(job)
+            job.status = "done"
+            return job.result
+        except Exception as exc:
+            job.error = f"{type(exc).__name__}: {exc}"
+            job.status = "failed"
+            raise
+        finally:
+            job.finished_at = time.time()
+            if job.status == "done":
+                job.publish({"event": "done", "job_id": job.id})
+            else:
+                job.publish({"event": "failed", "job_id": job.id, "error": job.error})
+            if self.on_finish is not None:
+                self.on_finish(job)
+            with self._lock:
+                release = job.release_on_finish
+            if release:
+                self.release(job)
+
+    def evict_expired(self) -> None:
+        now = time.time()
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.finished_at is not None and now - job.finished_at > self.job_ttl_sec
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+
+        if self.on_evict is not None:
+            for job in expired:
+                self.on_evict(job)
@@ -0,0 +1,114 @@
+from typing import Optional
+
+from utils.metrics_utils import MetricsRegistry
+
+# страниц в одном запросе
+PAGES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class ServiceMetrics:
+    """
+    Метрики API для GET /metrics.
+
+    - HTTP: число запросов и задержка по маршрутам
+    - задачи: длительность, итог, страниц на задачу
+    - стадии: время каждой стадии (predict.<модель>, crop_pass, rasterize, ...)
+      приходит наблюдателем из StageTimer (observe_stage)
+    - состояние: очередь задач и планировщика, кэш, triage, каскад — снимается
+      в момент запроса /metrics (refresh)
+    """
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        r = self.registry
+
+        self.http_requests = r.counter(
+            "di_http_requests_total", "HTTP requests", ["method", "path", "status"]
+        )
+        self.http_latency = r.histogram(
+            "di_http_request_duration_seconds", "HTTP request latency", ["method", "path"]
+        )
+
+        self.jobs = r.counter("di_jobs_total", "Finished jobs", ["status"])
+        self.job_latency = r.histogram("di_job_duration_seconds", "Job processing time (queue excluded)")
+        self.job_pages = r.histogram("di_job_pages", "Pages per job", buckets=PAGES_BUCKETS)
+
+        self.stage_latency = r.histogram(
+            "di_stage_duration_seconds", "Time per pipeline stage call", ["stage"]
+        )
+        self.stage_items = r.counter(
+            "di_stage_items_total", "Pages (crops for the crop pass) processed per stage", ["stage"]
+        )
+
+        self.jobs_pending = r.gauge("di_jobs_pending", "Jobs queued or running")
+        self.scheduler_queue = r.gauge("di_scheduler_queue_depth", "Pages waiting for the inference scheduler")
+        self.scheduler_batch = r.gauge("di_scheduler_avg_batch_size", "Average pages per scheduler batch")
+        self.cache_lookups = r.counter("di_cache_lookups_total", "Detection cache lookups", ["result"])
+        self.cache_hit_ratio = r.gauge("di_cache_hit_ratio", "Detection cache hit ratio")
+        self.dedup_pages = r.counter(
+            "di_dedup_pages_total", "Near-duplicate index lookups", ["result"]
+        )
+        self.scratch_used = r.gauge("di_scratch_used_megabytes", "Uploads kept in the API scratch space")
+        self.triage_calls_saved = r.counter(
+            "di_triage_calls_saved_total", "Page-model calls skipped by triage", ["model"]
+        )
+        self.cascade_pages = r.counter(
+            "di_cascade_pages_total",
+            "Coarse-pass decisions per page: skipped / regions (full pass avoided) or full",
+            ["model", "decision"],
+        )
+
+    def observe_stage(self, stage: str, seconds: float, items: int) -> None:
+        """Наблюдатель для StageTimer.add_observer."""
+        self.stage_latency.observe(seconds, stage=stage)
+        if items:
+            self.stage_items.inc(items, stage=stage)
+
+    def observe_request(self, method: str, path: str, status: int, seconds: float) -> None:
+        self.http_requests.inc(method=method, path=path, status=str(status))
+        self.http_latency.observe(seconds, method=method, path=path)
+
+    def observe_job(self, status: str, seconds: float, pages: int) -> None:
+        self.jobs.inc(status=status)
+        self.job_latency.observe(seconds)
+        self.job_pages.observe(pages)
+
+    def refresh(self, jobs, scheduler, cache=None, triage=None, scratch=None, dedup=None, cascade=None) -> None:
+        """Снимает текущее состояние очередей, кэша, triage, dedup, каскада и рабочей папки перед отдачей /metrics."""
+        self.jobs_pending.set(jobs.pending())
+
+        stats = scheduler.stats()
+        self.scheduler_queue.set(stats["queue_depth"])
+        self.scheduler_batch.set(stats["avg_batch_size"])
+
+        if cache is not None:
+            cache_stats = cache.stats()
+            self.cache_lookups.set(cache_stats["hits"], result="hit")
+            self.cache_lookups.set(cache_stats["misses"], result="miss")
+            self.cache_hit_ratio.set(cache_stats["hit_rate"])
+
+        if dedup is not None:
+            dedup_stats = dedup.stats()
+            self.dedup_pages.set(dedup_stats["hits"], result="hit")
+            self.dedup_pages.set(dedup_stats["lookups"] - dedup_stats["hits"], result="miss")
+
+        if scratch is not None:
+            self.scratch_used.set(scratch.stats()["used_mb"])
+
+        if triage is not None:
+            for model, saved in triage.stats()["calls_saved"].items():
+                self.triage_calls_saved.set(saved, model=model)
+
+        if cascade is not None:
+            for model, decisions in cascade.stats()["decisions"].items():
+                for decision, pages in decisions.items():
+                    self.cascade_pages.set(pages, model=model, decision=decision)
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+def route_path(request) -> Optional[str]:
+    """Шаблон маршрута (/jobs/{job_id}), а не реальный путь — иначе метки разрастаются."""
+    route = request.scope.get("route")
+    return getattr(route, "path", None)
@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional
+
+import torch
+
+# маркер остановки потока планировщика
+_STOP = object()
+
+# ошибки не конкретной страницы, а всего прогона: повтор по одной их не лечит
+_SYSTEMIC_ERRORS = (MemoryError, torch.cuda.OutOfMemoryError)
+
+
+def _is_page_specific(exc: BaseException) -> bool:
+    return not isinstance(exc, _SYSTEMIC_ERRORS) and "out of memory" not in str(exc).lower()
+
+
+class InferenceScheduler:
+    """
+    Динамический micro-batching между API и EnsembleDetector.
+
+    Страницы от всех одновременных запросов складываются в одну очередь;
+    отдельный поток собирает из неё пачку — до max_batch_size страниц или
+    пока не пройдёт max_wait_ms с момента первой страницы — и прогоняет её
+    через ансамбль одним detect_on_pages. Результаты раздаются обратно
+    через Future каждого вызывающего.
+
+    Если пачка падает, её страницы прогоняются ещё раз по одной: ошибка
+    достаётся только Future той страницы, на которой она случилась, а не
+    всем запросам, попавшим в ту же пачку. Ошибки всего прогона (нехватка
+    памяти) по одной не повторяются — они сразу достаются всей пачке.
+
+    После close() (или если поток планировщика упал) submit бросает
+    RuntimeError, а все ещё не выполненные Future получают такую же ошибку —
+    никто не ждёт результата вечно.
+
+    Снаружи выглядит как ансамбль (detect_on_pages), поэтому его можно
+    передавать в process_pdf вместо EnsembleDetector.
+    """
+
+    def __init__(self, ensemble, max_batch_size: int = 8, max_wait_ms: float = 5.0):
+        self.ensemble = ensemble
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._batches = 0
+        self._pages = 0
+        self._failed_batches = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, page) -> Future:
+        """Ставит страницу в очередь, Future вернёт её список детекций."""
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("scheduler stopped")
+            self._queue.put((page, future))
+        return future
+
+    def detect_on_pages(self, pages: Iterable, batch_size: Optional[int] = None) -> List[List[Dict]]:
+        # batch_size вызывающего не важен: пачки формирует планировщик
+        futures = [self.submit(page) for page in pages]
+        return [f.result() for f in futures]
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict:
+        batches = self._batches
+        return {
+            "batches": batches,
+            "pages": self._pages,
+            "avg_batch_size": self._pages / batches if batches else 0.0,
+            "failed_batches": self._failed_batches,
+            "queue_depth": self.queue_depth(),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect_batch(self, first) -> List:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # доработаем текущую пачку и остановимся
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self) -> None:
+        batch: List = []
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    return
+
+                batch = self._collect_batch(item)
+                self._run_batch(batch)
+                batch = []
+        finally:
+            # остановка или падение потока: новые страницы не принимаем,
+            # текущая пачка и всё, что осталось в очереди, получают ошибку
+            with self._lock:
+                self._closed = True
+            pending = [future for _, future in batch]
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    pending.append(item[1])
+            for future in pending:
+                if not future.done():
+                    future.set_exception(RuntimeError("scheduler stopped"))
+
+    def _run_batch(self, batch: List) -> None:
+        pages = [page for page, _ in batch]
+        try:
+            results = self.ensemble.detect_on_pages(pages, batch_size=len(pages))
+        except Exception as exc:
+            self._failed_batches += 1
+            if len(batch) > 1 and _is_page_specific(exc):
+                self._run_one_by_one(batch)
+            else:
+                for _, future in batch:
+                    future.set_exception(exc)
+            return
+
+        self._batches += 1
+        self._pages += len(pages)
+        for (_, future), detections in zip(batch, results):
+            future.set_result(detections)
+
+    def _run_one_by_one(self, batch: List) -> None:
+        """Упавшая пачка: каждая страница отдельно, ошибка — только своему Future."""
+        for page, future in batch:
+            try:
+                detections = self.ensemble.detect_on_pages([page], batch_size=1)[0]
+            except Exception as exc:
+                future.set_exception(exc)
+                continue
+            self._batches += 1
+            self._pages += 1
+            future.set_result(detections)
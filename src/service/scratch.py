@@ -0,0 +1,163 @@
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+
+class ScratchQuotaError(Exception):
+    """Загрузка не помещается в квоту рабочей папки — API отвечает 507."""
+
+
+class UploadTooLargeError(Exception):
+    """Файл больше max_upload_mb — API отвечает 413."""
+
+
+class ScratchSpace:
+    """
+    Рабочая папка API (api.tmp_dir) с квотой на диск.
+
+    На каждый запрос — своя папка с uuid-именем, загрузки внутри тоже
+    получают uuid-имена (имя от клиента остаётся только именем документа
+    в ответе). Файл пишется на диск кусками по chunk_size, целиком в память
+    не читается. Папка задачи удаляется remove() — когда задача вытеснена
+    из JobManager или не попала в очередь.
+
+    Квота считается по загрузкам: сумма размеров живых загрузок не больше
+    quota_mb. При старте сервиса папки запросов прошлого процесса удаляются —
+    его задачи всё равно потеряны.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        quota_mb: Optional[float] = None,
+        max_upload_mb: Optional[float] = None,
+        chunk_size: int = 1024 * 1024,
+    ):
+        self.root = Path(root)
+        self.quota = int(quota_mb * 1024 * 1024) if quota_mb else None
+        self.max_upload = int(max_upload_mb * 1024 * 1024) if max_upload_mb else None
+        self.chunk_size = chunk_size
+
+        self._used = 0
+        self._sizes: Dict[Path, int] = {}
+        self._lock = threading.Lock()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        # трогаем только папки запросов (uuid), а не всё, что лежит в root
+        for stale in self.root.iterdir():
+            if stale.is_dir() and len(stale.name) == 32 and all(c in "0123456789abcdef" for c in stale.name):
+                shutil.rmtree(stale, ignore_errors=True)
+
+    def create(self) -> Path:
+        """Новая папка под запрос."""
+        path = self.root / uuid.uuid4().hex
+        path.mkdir(parents=True)
+        with self._lock:
+            self._sizes[path] = 0
+        return path
+
+    def _reserve(self, path: Path, size: int) -> None:
+        with self._lock:
+            if self.quota is not None and self._used + size > self.quota:
+                raise ScratchQuotaError(
+                    f"scratch space quota exceeded ({self.quota // (1024 * 1024)} MB), retry later"
+                )
+            self._used += size
+            self._sizes[path] = self._sizes.get(path, 0) + size
+
+    async def save_upload(self, upload, path: Path) -> Path:
+        """
+        Пишет UploadFile в папку path кусками и возвращает путь к файлу.
+        Запись на диск идёт в пуле потоков, а не в event loop: большая загрузка
+        не останавливает остальные запросы и потоковые ответы.
+        При превышении max_upload_mb / квоты файл удаляется, а ошибка
+        пробрасывается (папку целиком удаляет вызывающий через remove()).
+        """
+        file_path = path / f"{uuid.uuid4().hex}{Path(upload.filename or '').suffix.lower() or '.pdf'}"
+        written = 0
+        try:
+            f = await run_in_threadpool(open, file_path, "wb")
+            try:
+                while True:
+                    chunk = await upload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if self.max_upload is not None and written > self.max_upload:
+                        raise UploadTooLargeError(
+                            f"{upload.filename}: file is larger than {self.max_upload // (1024 * 1024)} MB"
+                        )
+                    self._reserve(path, len(chunk))
+                    await run_in_threadpool(f.write, chunk)
+            finally:
+                await run_in_threadpool(f.close)
+        except Exception:
+            file_path.unlink(missing_ok=True)
+            raise
+        finally:
+            await upload.close()
+        return file_path
+
+    def remove(self, path: Path) -> None:
+        with self._lock:
+            self._used -= self._sizes.pop(path, 0)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "dirs": len(self._sizes),
+                "used_mb": round(self._used / (1024 * 1024), 2),
+                "quota_mb": self.quota // (1024 * 1024) if self.quota is not None else None,
+            }
+
+
+class RequestSizeLimit:
+    """
+    ASGI-middleware: тело запроса не больше max_bytes.
+
+    Starlette складывает multipart-загрузку во временный файл целиком ещё до
+    обработчика, так что max_upload_mb в save_upload диск не ограничивает.
+    Здесь запрос с Content-Length больше лимита отклоняется сразу (413), а
+    тело без Content-Length (chunked) обрывается, как только превысит лимит.
+    """
+
+    def __init__(self, app, max_bytes: Optional[int]):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def _error(self) -> HTTPException:
+        return HTTPException(
+            status_code=413, detail=f"request body is larger than {self.max_bytes // (1024 * 1024)} MB"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse({"detail": self._error().detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise self._error()
+            return message
+
+        await self.app(scope, limited_receive, send)
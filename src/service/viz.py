@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from utils.pds_utils import PdfPage, render_options, render_page
+from utils.timing_utils import NULL_TIMER
+from utils.viz_utils import encode_image, render_overlay, viz_options
+
+
+class PageVizRenderer:
+    """
+    Визуализация страницы по запросу (GET /jobs/{id}/pages/{doc}/{page}/viz).
+
+    Во время задачи ничего не рисуется: картинка собирается только когда её
+    попросили — страница заново растеризуется из сохранённого PDF с теми же
+    параметрами render, что и при детекции, поверх рисуются детекции из
+    результата задачи. Последние max_pages растров держатся в LRU, чтобы
+    листание / смена формата не рендерили страницу повторно.
+    """
+
+    def __init__(self, cfg, max_pages: int = 16, timer=NULL_TIMER):
+        self.render_opts = render_options(cfg)
+        self.defaults = viz_options(cfg)
+        self.max_pages = max_pages
+        self.timer = timer
+        self._pages: "OrderedDict[Tuple[str, int], PdfPage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _page(self, pdf_path: str, page_num: int) -> PdfPage:
+        key = (pdf_path, page_num)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+
+        with self.timer.stage("viz_rasterize"):
+            page = render_page(pdf_path, page_num, **self.render_opts)
+
+        if self.max_pages > 0:
+            with self._lock:
+                self._pages[key] = page
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+        return page
+
+    def render(
+        self,
+        pdf_path: str,
+        page_num: int,
+        detections: List[Dict],
+        fmt: Optional[str] = None,
+        quality: Optional[int] = None,
+        max_side: Optional[int] = None,
+    ) -> Tuple[bytes, str]:
+        """
+        detections — в координатах страницы (как в JSON результата).
+        Незаданные fmt / quality / max_side берутся из секции viz конфига.
+        Возвращает (байты картинки, MIME-тип).
+        """
+        fmt = fmt or self.defaults["format"]
+        quality = quality if quality is not None else self.defaults["quality"]
+        max_side = max_side if max_side is not None else self.defaults["max_side"]
+
+        page = self._page(pdf_path, page_num)
+        with self.timer.stage("viz"):
+            image = render_overlay(page.image, page.to_image_coords(detections), max_side=max_side)
+            return encode_image(image, fmt, quality)
+
+    def forget(self, pdf_path: str) -> None:
+        """Выкидывает растры документа (например, когда задачу удалили)."""
+        with self._lock:
+            for key in [k for k in self._pages if k[0] == pdf_path]:
+                del self._pages[key]
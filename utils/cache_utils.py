@@ -0,0 +1,225 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.detectors.backends import model_files
+
+# ключи inference, которые влияют только на скорость, а не на результат
+_THROUGHPUT_ONLY_KEYS = {"batch_size", "crop_batch_size", "warmup"}
+
+# секции config.yaml (кроме inference), от которых зависят детекции;
+# dedup сюда не входит — его приближённые результаты в кэш не пишутся
+_RESULT_SECTIONS = ("triage", "cascade", "tiling")
+
+# хэши файлов весов: (путь, размер, mtime) -> sha1, чтобы не перечитывать веса
+_FILE_HASHES: Dict[tuple, str] = {}
+
+
+def file_fingerprint(path: str) -> str:
+    p = Path(path)
+    if not p.exists():
+        return "missing"
+    if p.is_dir():
+        # модель-каталог (OpenVINO: .xml + .bin + metadata.yaml)
+        h = hashlib.sha1()
+        for child in sorted(p.rglob("*")):
+            if child.is_file():
+                h.update(child.relative_to(p).as_posix().encode("utf-8"))
+                h.update(file_fingerprint(str(child)).encode("ascii"))
+        return h.hexdigest()
+    st = p.stat()
+    key = (str(p.resolve()), st.st_size, st.st_mtime)
+    if key not in _FILE_HASHES:
+        h = hashlib.sha1()
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _FILE_HASHES[key] = h.hexdigest()
+    return _FILE_HASHES[key]
+
+
+def detection_fingerprint(cfg) -> str:
+    """
+    Отпечаток всего, от чего зависят детекции: содержимое весов моделей
+    (того бэкенда, что выбран в inference.backend), пороги, img_size
+    и прочие настройки inference из config.yaml
+    (и секции вроде triage, которые меняют набор запускаемых моделей).
+    """
+    inference = {
+        k: v for k, v in cfg["inference"].items() if k not in _THROUGHPUT_ONLY_KEYS
+    }
+    payload = {
+        "models": {
+            name: file_fingerprint(path)
+            for name, path in sorted(model_files(cfg).items())
+        },
+        "inference": inference,
+        "sections": {name: cfg.get(name) for name in _RESULT_SECTIONS},
+    }
+    blob = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()
+
+
+def page_hash(image: np.ndarray) -> str:
+    """Хэш пикселей страницы (вместе с формой массива)."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str(image.shape).encode("ascii"))
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+class DetectionCache:
+    """
+    Кэш детекций страницы: ключ = хэш пикселей + отпечаток моделей/конфига.
+
+    Два уровня:
+      - в памяти: LRU на memory_items страниц
+      - на диске: JSON-файлы в disk_dir, при превышении disk_max_mb
+        удаляются самые давно использованные
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        memory_items: int = 2048,
+        disk_dir: Optional[str] = None,
+        disk_max_mb: float = 1024,
+    ):
+        self.fingerprint = fingerprint
+        self.memory_items = memory_items
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+
+        self._memory: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk_bytes = 0
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(p.stat().st_size for p in self.disk_dir.glob("*/*.json"))
+
+    def key(self, image: np.ndarray) -> str:
+        return hashlib.sha1(
+            (page_hash(image) + self.fingerprint).encode("ascii")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            dets = self._memory.get(key)
+            if dets is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(dets)
+
+        dets = self._disk_get(key)
+        with self._lock:
+            if dets is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._memory_put(key, dets)
+        return copy.deepcopy(dets)
+
+    def put(self, key: str, detections: List[Dict]) -> None:
+        dets = copy.deepcopy(detections)
+        with self._lock:
+            self._memory_put(key, dets)
+        self._disk_put(key, dets)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+            "disk_mb": round(self._disk_bytes / (1024 * 1024), 2),
+        }
+
+    # ---- уровень в памяти ----
+
+    def _memory_put(self, key: str, dets: List[Dict]) -> None:
+        self._memory[key] = dets
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    # ---- уровень на диске ----
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key: str) -> Optional[List[Dict]]:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                dets = json.load(f)
+            os.utime(path)  # mtime = время последнего использования (для вытеснения)
+            return dets
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key: str, dets: List[Dict]) -> None:
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dets, f, ensure_ascii=False)
+        os.replace(tmp_path, path)  # атомарно: параллельные воркеры не видят полузаписанный файл
+
+        with self._lock:
+            self._disk_bytes += path.stat().st_size
+            if self._disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+
+    def _disk_evict(self) -> None:
+        """Удаляет самые давно использованные файлы, пока не уложимся в 90% лимита."""
+        files = []
+        for p in self.disk_dir.glob("*/*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, p in files:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+
+def build_detection_cache(cfg) -> Optional[DetectionCache]:
+    """Кэш по секции cache из config.yaml (None, если выключен)."""
+    cache_cfg = cfg.get("cache", {})
+    if not cache_cfg.get("enabled", False):
+        return None
+    return DetectionCache(
+        detection_fingerprint(cfg),
+        memory_items=cache_cfg.get("memory_items", 2048),
+        disk_dir=cache_cfg.get("disk_dir"),
+        disk_max_mb=cache_cfg.get("disk_max_mb", 1024),
+    )
@@ -0,0 +1,255 @@
+import copy
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# сторона картинки для DCT и сколько низких частот берём (8x8 = 64 бита)
+_DCT_SIZE = 32
+_HASH_SIZE = 8
+_HASH_BITS = _HASH_SIZE * _HASH_SIZE
+
+# маски для проверки кандидата: сторона, размер блока, допуск на сдвиг (px маски)
+_MASK_SIZE = 256
+_MASK_BLOCK = 16
+_MASK_SHIFT = 3
+
+
+def _gray(image: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def phash(image: np.ndarray) -> int:
+    """
+    Перцептивный хэш страницы (DCT pHash, 64 бита).
+
+    Серое 32x32 -> DCT -> левый верхний 8x8 (низкие частоты) -> бит = коэффициент
+    выше медианы. По серому, поэтому цветной скан и его ч/б копия дают близкие
+    хэши; пересканирование и небольшой сдвиг меняют лишь несколько бит.
+    """
+    small = cv2.resize(_gray(image), (_DCT_SIZE, _DCT_SIZE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small.astype(np.float32))[:_HASH_SIZE, :_HASH_SIZE].flatten()
+    # DC-коэффициент (средняя яркость) в медиану не берём
+    bits = low > np.median(low[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def page_masks(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Маски для проверки совпадения (_MASK_SIZE x _MASK_SIZE, упакованы packbits):
+      - ink   — «чернила» относительно фона самой страницы, так что яркость,
+                контраст и бинаризация скана на маску почти не влияют
+      - color — синие/фиолетовые пиксели (печати, подписи ручкой), как в triage
+    """
+    small = cv2.resize(image, (_MASK_SIZE, _MASK_SIZE), interpolation=cv2.INTER_AREA)
+    gray = _gray(small).astype(np.float32)
+    background = np.percentile(gray, 90)
+    darkest = np.percentile(gray, 0.5)
+    ink = (background - gray) / max(background - darkest, 1.0) > 0.35
+
+    if small.ndim == 3:
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        hue, sat, val = hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
+        color = (sat > 60) & (val > 40) & (hue >= 90) & (hue <= 160)
+    else:
+        color = np.zeros_like(ink)
+    return np.packbits(ink), np.packbits(color)
+
+
+def _unpack(mask: np.ndarray) -> np.ndarray:
+    return np.unpackbits(mask)[: _MASK_SIZE * _MASK_SIZE].reshape(_MASK_SIZE, _MASK_SIZE).astype(bool)
+
+
+def _added(old: np.ndarray, new: np.ndarray) -> float:
+    """
+    Доля пикселей new, которых нет в old даже с допуском на сдвиг, — максимум
+    по блокам маски (новая подпись / печать даёт заметный блок, сдвиг скана — нет).
+    """
+    kernel = np.ones((2 * _MASK_SHIFT + 1, 2 * _MASK_SHIFT + 1), np.uint8)
+    grown = cv2.dilate(old.astype(np.uint8), kernel).astype(bool)
+    n = _MASK_SIZE // _MASK_BLOCK
+    added = (new & ~grown).reshape(n, _MASK_BLOCK, n, _MASK_BLOCK).mean(axis=(1, 3))
+    return float(added.max())
+
+
+def masks_differ(old, new, max_ink_diff: float, max_color_diff: float) -> bool:
+    """
+    old / new — page_masks() двух страниц. Разные, если чернила появились или
+    пропали хоть в одном блоке, или появился новый синий/фиолетовый цвет.
+    Пропавший цвет разницей не считается: это ч/б копия того же листа.
+    """
+    old_ink, old_color = (_unpack(m) for m in old)
+    new_ink, new_color = (_unpack(m) for m in new)
+    if max(_added(old_ink, new_ink), _added(new_ink, old_ink)) > max_ink_diff:
+        return True
+    return _added(old_color, new_color) > max_color_diff
+
+
+class _Entry:
+    __slots__ = ("hash", "masks", "shape", "detections", "source")
+
+    def __init__(self, hash_value, masks, shape, detections, source):
+        self.hash = hash_value
+        self.masks = masks
+        self.shape = shape
+        self.detections = detections
+        self.source = source
+
+
+class PageDedupIndex:
+    """
+    Индекс почти одинаковых страниц: варианты одного документа (АПЗ-, АПЗ-2,
+    АПЗ-41-чб, ...) отличаются пересканированием или переводом в ч/б, и точный
+    кэш по пикселям их не ловит.
+
+    Для каждой обработанной страницы хранятся pHash, маски и детекции.
+    Новая страница ищется по расстоянию Хэмминга <= max_distance: хэш режется
+    на max_distance + 1 полос, и по принципу Дирихле у близкого хэша хотя бы
+    одна полоса совпадает точно — кандидаты берутся из корзин полос, а не
+    перебором всего индекса.
+
+    verify — кандидат дополнительно сверяется по маскам чернил и цвета
+    (page_masks): если в каком-то блоке чернила появились / пропали больше
+    чем на verify_max_ink_diff или появился новый синий цвет больше чем на
+    verify_max_color_diff (другая подпись или печать), страница считается
+    новой и идёт через детекторы. Проверка эвристическая: чёрная подпись
+    поверх плотного текста может её пройти — пороги настраиваются.
+
+    Детекции переиспользуются с масштабированием под размер новой картинки;
+    источник (документ и страница) отдаётся вместе с ними.
+    """
+
+    def __init__(
+        self,
+        max_distance: int = 6,
+        verify: bool = True,
+        verify_max_ink_diff: float = 0.09,
+        verify_max_color_diff: float = 0.03,
+        max_items: int = 4096,
+        max_aspect_diff: float = 0.02,
+    ):
+        self.max_distance = max_distance
+        self.verify = verify
+        self.verify_max_ink_diff = verify_max_ink_diff
+        self.verify_max_color_diff = verify_max_color_diff
+        self.max_items = max_items
+        self.max_aspect_diff = max_aspect_diff
+
+        bands = max_distance + 1
+        width = -(-_HASH_BITS // bands)
+        self._bands = [(start, min(width, _HASH_BITS - start)) for start in range(0, _HASH_BITS, width)]
+
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: List[Dict[int, set]] = [{} for _ in self._bands]
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0
+
+    def _band_keys(self, hash_value: int) -> List[int]:
+        return [(hash_value >> start) & ((1 << width) - 1) for start, width in self._bands]
+
+    def lookup(self, image: np.ndarray) -> Optional[Tuple[List[Dict], Dict]]:
+        """
+        (детекции в пикселях image, {"source", "distance"}) ближайшей подходящей
+        страницы индекса или None.
+        """
+        hash_value = phash(image)
+        h, w = image.shape[:2]
+        masks = None
+
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for bucket, key in zip(self._buckets, self._band_keys(hash_value)):
+                candidates.update(bucket.get(key, ()))
+
+            ranked = []
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                distance = hamming(hash_value, entry.hash)
+                if distance <= self.max_distance:
+                    ranked.append((distance, entry_id, entry))
+            ranked.sort(key=lambda item: item[:2])
+
+            for distance, entry_id, entry in ranked:
+                old_h, old_w = entry.shape
+                if abs(w / h - old_w / old_h) > self.max_aspect_diff * (old_w / old_h):
+                    continue
+                if self.verify:
+                    if masks is None:
+                        masks = page_masks(image)
+                    if masks_differ(entry.masks, masks, self.verify_max_ink_diff, self.verify_max_color_diff):
+                        self.rejected += 1
+                        continue
+
+                self.hits += 1
+                self._entries.move_to_end(entry_id)
+                detections = _scale_detections(entry.detections, w / old_w, h / old_h)
+                return detections, {"source": entry.source, "distance": distance}
+        return None
+
+    def add(self, image: np.ndarray, detections: List[Dict], source: Optional[str] = None) -> None:
+        hash_value = phash(image)
+        masks = page_masks(image) if self.verify else None
+        entry = _Entry(hash_value, masks, image.shape[:2], copy.deepcopy(detections), source)
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            for bucket, key in zip(self._buckets, self._band_keys(hash_value)):
+                bucket.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_items:
+                old_id, old = self._entries.popitem(last=False)
+                for bucket, key in zip(self._buckets, self._band_keys(old.hash)):
+                    ids = bucket.get(key)
+                    if ids is not None:
+                        ids.discard(old_id)
+                        if not ids:
+                            del bucket[key]
+
+    def stats(self) -> Dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "rejected": self.rejected,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "items": len(self._entries),
+        }
+
+
+def _scale_detections(detections: List[Dict], sx: float, sy: float) -> List[Dict]:
+    scaled = copy.deepcopy(detections)
+    if sx == 1.0 and sy == 1.0:
+        return scaled
+    for det in scaled:
+        x, y, w, h = det["bbox"]
+        det["bbox"] = [x * sx, y * sy, w * sx, h * sy]
+    return scaled
+
+
+def build_dedup_index(cfg) -> Optional[PageDedupIndex]:
+    """Индекс по секции dedup из config.yaml (None, если выключен)."""
+    dedup_cfg = cfg.get("dedup", {})
+    if not dedup_cfg.get("enabled", False):
+        return None
+    return PageDedupIndex(
+        max_distance=dedup_cfg.get("max_distance", 6),
+        verify=dedup_cfg.get("verify", True),
+        verify_max_ink_diff=dedup_cfg.get("verify_max_ink_diff", 0.09),
+        verify_max_color_diff=dedup_cfg.get("verify_max_color_diff", 0.03),
+        max_items=dedup_cfg.get("max_items", 4096),
+    )
@@ -1,57 +1,72 @@
 import json
+import os
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
-def build_results_dict(all_docs_predictions: Dict) -> Dict:
-    result = {}
-    for doc_name, pages in all_docs_predictions.items():
-        doc_entry = {}
-        annotation_counter = 1   # счётчик как в примере selected_annotations
+def build_annotation(det: Dict) -> Dict:
+    """Детекция -> аннотация итогового JSON (без ключа annotation_N)."""
+    x, y, w, h = det["bbox"]
+
+    area = float(w) * float(h)
+
+    # score, stamp_with_signature — не добавляем
+    return {
+        "category": det["category"],
+        "bbox": {
+            "x": float(x),
+            "y": float(y),
+            "width": float(w),
+            "height": float(h),
+        },
+        "area": area,
+    }
+
 
-        for page_num, page_info in pages.items():
-            width, height = page_info["size"]
-            detections = page_info["detections"]
+def page_size_entry(page_info: Dict) -> Dict:
+    width, height = page_info["size"]
+    return {
+        "width": int(width),
+        "height": int(height),
+    }
 
-            # 🔴 ВАЖНО: если на странице нет детекций — вообще не добавляем этот page_X
-            if not detections:
-                continue
 
-            page_key = f"page_{page_num}"
+def build_doc_entry(pages: Dict) -> Dict:
+    """
+    Предсказания одного документа ({номер страницы: {"size", "detections"}})
+    -> {"page_N": {"annotations", "page_size"}}. Пустой dict, если детекций нет.
+    """
+    doc_entry = {}
+    annotation_counter = 1   # счётчик как в примере selected_annotations
 
-            page_entry = {
-                "annotations": [],
-                "page_size": {
-                    "width": int(width),
-                    "height": int(height),
-                },
-            }
+    for page_num, page_info in pages.items():
+        detections = page_info["detections"]
 
-            for det in detections:
-                x, y, w, h = det["bbox"]
+        # 🔴 ВАЖНО: если на странице нет детекций — вообще не добавляем этот page_X
+        if not detections:
+            continue
 
-                area = float(w) * float(h)
+        page_entry = {
+            "annotations": [],
+            "page_size": page_size_entry(page_info),
+        }
 
-                ann_key = f"annotation_{annotation_counter}"
-                annotation_counter += 1
+        for det in detections:
+            ann_key = f"annotation_{annotation_counter}"
+            annotation_counter += 1
+            page_entry["annotations"].append({ann_key: build_annotation(det)})
 
-                ann_data = {
-                    "category": det["category"],
-                    "bbox": {
-                        "x": float(x),
-                        "y": float(y),
-                        "width": float(w),
-                        "height": float(h),
-                    },
-                    "area": area,
-                }
+        # Добавляем страницу только если есть аннотации (на всякий случай)
+        if page_entry["annotations"]:
+            doc_entry[f"page_{page_num}"] = page_entry
 
-                # score, stamp_with_signature — не добавляем
-                page_entry["annotations"].append({ann_key: ann_data})
+    return doc_entry
 
-            # Добавляем страницу только если есть аннотации (на всякий случай)
-            if page_entry["annotations"]:
-                doc_entry[page_key] = page_entry
+
+def build_results_dict(all_docs_predictions: Dict) -> Dict:
+    result = {}
+    for doc_name, pages in all_docs_predictions.items():
+        doc_entry = build_doc_entry(pages)
 
         # Если у документа нет ни одной страницы с аннотациями — не включаем его
         if doc_entry:
@@ -66,3 +81,67 @@ def save_results_json(all_docs_predictions: Dict, output_path: str):
     output_path.parent.mkdir(parents=True, exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+class StreamingResultsWriter:
+    """
+    Результаты по мере готовности документов, без сборки всего словаря в памяти.
+
+    add_document() сразу дописывает документ строкой в JSONL
+    ({"document": имя, "pages": {"page_N": ...}} — схема и нумерация аннотаций
+    как в итоговом JSON) и сбрасывает её на диск: прерванный прогон оставляет
+    все готовые документы. В памяти держатся только смещения строк.
+
+    close(order) собирает из JSONL итоговый файл, байт в байт такой же, как
+    save_results_json (документы в порядке order, а не завершения).
+    """
+
+    def __init__(self, output_path: str, jsonl_path: Optional[str] = None):
+        self.output_path = Path(output_path)
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else self.output_path.with_suffix(".jsonl")
+        self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self._jsonl = open(self.jsonl_path, "wb")
+
+    def add_document(self, doc_name: str, pages: Dict) -> None:
+        doc_entry = build_doc_entry(pages)
+        # документ без аннотаций в итоговый JSON не попадает — и в JSONL тоже
+        if not doc_entry:
+            return
+
+        line = json.dumps({"document": doc_name, "pages": doc_entry}, ensure_ascii=False)
+        data = (line + "\n").encode("utf-8")
+        self._offsets[doc_name] = (self._jsonl.tell(), len(data))
+        self._jsonl.write(data)
+        self._jsonl.flush()
+
+    def _read_entry(self, reader, doc_name: str) -> Dict:
+        offset, size = self._offsets[doc_name]
+        reader.seek(offset)
+        return json.loads(reader.read(size))["pages"]
+
+    def close(self, order: Optional[Iterable[str]] = None) -> Path:
+        """
+        Пишет итоговый файл и возвращает его путь.
+        order — порядок документов (по умолчанию — порядок add_document).
+        """
+        self._jsonl.close()
+        names: List[str] = [n for n in (order if order is not None else self._offsets) if n in self._offsets]
+
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.output_path.with_suffix(self.output_path.suffix + ".tmp")
+        with open(self.jsonl_path, "rb") as reader, open(tmp_path, "w", encoding="utf-8") as f:
+            if not names:
+                f.write("{}")
+            else:
+                # то же, что json.dump(..., indent=2) для всего словаря, но по одному документу
+                f.write("{\n")
+                for i, doc_name in enumerate(names):
+                    body = json.dumps(self._read_entry(reader, doc_name), ensure_ascii=False, indent=2)
+                    key = json.dumps(doc_name, ensure_ascii=False)
+                    f.write(f"  {key}: " + body.replace("\n", "\n  "))
+                    f.write(",\n" if i < len(names) - 1 else "\n")
+                f.write("}")
+        os.replace(tmp_path, self.output_path)
+        return self.output_path
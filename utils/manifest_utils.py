@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from utils.cache_utils import detection_fingerprint, file_fingerprint
+
+
+def run_fingerprint(cfg) -> str:
+    """Отпечаток моделей + конфига инференса + настроек рендера и dedup (он меняет результат в шардах)."""
+    payload = {
+        "detection": detection_fingerprint(cfg),
+        "render": cfg.get("render", {}),
+        "dedup": cfg.get("dedup"),
+    }
+    blob = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()
+
+
+def _write_json_atomic(path: Path, data) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class RunManifest:
+    """
+    Манифест инкрементального прогона main_infer.
+
+    manifest.json: {имя PDF: {"sha1", "fingerprint", "shard", "pages"}}
+    shards/<имя PDF>.json: предсказания документа (как у process_pdf)
+
+    Шард и манифест пишутся сразу после каждого документа, поэтому
+    упавший или прерванный прогон теряет максимум текущий документ.
+    """
+
+    def __init__(self, root_dir: str, fingerprint: str):
+        self.root_dir = Path(root_dir)
+        self.shards_dir = self.root_dir / "shards"
+        self.manifest_path = self.root_dir / "manifest.json"
+        self.fingerprint = fingerprint
+
+        self.entries: Dict[str, Dict] = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def needs_update(self, pdf_path: Path) -> bool:
+        """True, если PDF новый, изменился или считан другой моделью/конфигом."""
+        entry = self.entries.get(pdf_path.name)
+        if entry is None:
+            return True
+        if entry["fingerprint"] != self.fingerprint:
+            return True
+        if entry["sha1"] != file_fingerprint(str(pdf_path)):
+            return True
+        return not (self.shards_dir / entry["shard"]).exists()
+
+    def record(self, pdf_path: Path, doc_predictions: Dict) -> None:
+        shard_name = f"{pdf_path.name}.json"
+        shard = {
+            str(page_num): {
+                "size": list(info["size"]),
+                "detections": info["detections"],
+                **({"dedup_of": info["dedup_of"]} if "dedup_of" in info else {}),
+            }
+            for page_num, info in doc_predictions.items()
+        }
+        _write_json_atomic(self.shards_dir / shard_name, shard)
+
+        self.entries[pdf_path.name] = {
+            "sha1": file_fingerprint(str(pdf_path)),
+            "fingerprint": self.fingerprint,
+            "shard": shard_name,
+            "pages": len(doc_predictions),
+        }
+        _write_json_atomic(self.manifest_path, self.entries)
+
+    def load(self, doc_name: str) -> Optional[Dict]:
+        """Предсказания документа из шарда (ключи страниц снова int)."""
+        entry = self.entries.get(doc_name)
+        if entry is None:
+            return None
+        with open(self.shards_dir / entry["shard"], "r", encoding="utf-8") as f:
+            shard = json.load(f)
+        return {
+            int(page_num): {
+                "size": tuple(info["size"]),
+                "detections": info["detections"],
+                **({"dedup_of": info["dedup_of"]} if "dedup_of" in info else {}),
+            }
+            for page_num, info in sorted(shard.items(), key=lambda kv: int(kv[0]))
+        }
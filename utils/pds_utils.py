@@ -1,33 +1,638 @@
+import multiprocessing as mp
 import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-import fitz  
+import cv2
+import fitz
+import numpy as np
 from tqdm import tqdm
 
+from utils.timing_utils import NULL_TIMER
 
-def pdf_to_images(pdf_path: str, output_dir: str) -> Dict[int, Dict]:
+
+class PdfReadError(ValueError):
+    """Файл не открывается как PDF (битый, пустой, не PDF или под паролем) — API отвечает 422."""
+
+
+def open_pdf(pdf_path) -> "fitz.Document":
+    """fitz.open с понятной ошибкой для файлов, которые не прочитать как PDF."""
+    try:
+        doc = fitz.open(pdf_path)
+    except fitz.FileDataError as exc:
+        # текст fitz содержит путь на сервере — наружу отдаём только суть
+        raise PdfReadError("not a readable PDF") from exc
+    if doc.needs_pass:
+        doc.close()
+        raise PdfReadError("PDF is password-protected")
+    return doc
+
+
+class PdfPage:
+    """
+    Отрендеренная страница PDF, которая живёт в памяти.
+
+    image      — np.ndarray (H, W, 3) uint8 в BGR-порядке (как у cv2 / ultralytics),
+    image_path — путь к PNG, если страницу попросили сохранить на диск, иначе None.
+    page_size  — (ширина, высота) страницы в пикселях рендера при render.dpi:
+                 в этой системе координат пишутся page_size и bbox в JSON.
+    transform  — (sx, sy, tx, ty): пиксель картинки (x, y) -> (x * sx + tx, y * sy + ty)
+                 в координатах page_size. Для отрендеренной страницы — (1, 1, 0, 0),
+                 для вытащенного напрямую скана — своё разрешение и смещение.
+    source     — "render" или "embedded".
+    doc_name   — имя документа (проставляет process_pdf), dedup_of — откуда взяты
+                 детекции, если страница совпала с уже обработанной (PageDedupIndex).
+    tiles      — PageTiles для большого листа (проставляет process_pdf при tiling),
+                 иначе None.
+    """
+
+    def __init__(
+        self,
+        page_num: int,
+        image: np.ndarray,
+        image_path: Optional[str] = None,
+        page_size: Optional[Tuple[int, int]] = None,
+        transform: Tuple[float, float, float, float] = (1.0, 1.0, 0.0, 0.0),
+        source: str = "render",
+    ):
+        self.page_num = page_num
+        self.image = image
+        self.image_path = image_path
+        self.page_size = page_size or (int(image.shape[1]), int(image.shape[0]))
+        self.transform = transform
+        self.source = source
+        self.doc_name: Optional[str] = None
+        self.dedup_of: Optional[Dict] = None
+        self.tiles: Optional["PageTiles"] = None
+
+    @property
+    def width(self) -> int:
+        return int(self.page_size[0])
+
+    @property
+    def height(self) -> int:
+        return int(self.page_size[1])
+
+    def to_page_coords(self, detections: List[Dict]) -> List[Dict]:
+        """Детекции в пикселях image -> в координатах page_size (копии, с клипом по странице)."""
+        if self.transform == (1.0, 1.0, 0.0, 0.0):
+            return detections
+
+        sx, sy, tx, ty = self.transform
+        page_w, page_h = self.page_size
+        mapped = []
+        for det in detections:
+            x, y, w, h = det["bbox"]
+            x1 = min(max(x * sx + tx, 0.0), page_w)
+            y1 = min(max(y * sy + ty, 0.0), page_h)
+            x2 = min(max((x + w) * sx + tx, 0.0), page_w)
+            y2 = min(max((y + h) * sy + ty, 0.0), page_h)
+            mapped.append({**det, "bbox": [x1, y1, x2 - x1, y2 - y1]})
+        return mapped
+
+    def to_image_coords(self, detections: List[Dict]) -> List[Dict]:
+        """Обратно к to_page_coords: детекции из JSON -> в пиксели image (например, для viz)."""
+        if self.transform == (1.0, 1.0, 0.0, 0.0):
+            return detections
+
+        sx, sy, tx, ty = self.transform
+        mapped = []
+        for det in detections:
+            x, y, w, h = det["bbox"]
+            mapped.append({**det, "bbox": [(x - tx) / sx, (y - ty) / sy, w / sx, h / sy]})
+        return mapped
+
+
+def pixmap_to_bgr(pix: "fitz.Pixmap") -> np.ndarray:
+    """fitz.Pixmap -> np.ndarray (H, W, 3) BGR без промежуточного PNG."""
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+    if pix.alpha:
+        arr = arr[:, :, :-1]
+
+    if arr.shape[2] == 1:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
+
+
+# допуск (в pt), с которым картинка должна покрывать страницу целиком
+_FULL_PAGE_TOLERANCE = 2.0
+
+# операторы content stream, которые не рисуют ничего, кроме самой картинки
+_IMAGE_ONLY_OPS = {"q", "Q", "cm", "Do", "BMC", "BDC", "EMC"}
+
+_CONTENT_TOKEN = re.compile(rb"/[^\s/\[\]()<>{}%]+|[-+]?(?:\d+\.?\d*|\.\d+)|[A-Za-z'\"]+\*?|\S")
+
+
+def _single_image_placement(page: "fitz.Page", image_name: str) -> Optional[fitz.Matrix]:
+    """
+    Разбирает content stream страницы и возвращает матрицу размещения
+    картинки (в координатах PDF), если страница — это только q/cm/Do/Q
+    ровно одной картинки image_name. Иначе None (текст, пути, inline-картинки,
+    графические состояния и т.п.).
+
+    Сканеры пишут что-то вроде «q 1190 0 0 1684 0 0 cm /image Do Q»; разбор
+    байтов дешевле page.get_image_info(), который прогоняет страницу через device.
+    """
+    ctm = fitz.Matrix(1, 0, 0, 1, 0, 0)
+    stack = []
+    operands = []
+    placement = None
+
+    for token in _CONTENT_TOKEN.findall(page.read_contents()):
+        if token[:1] == b"/" or token[:1] in b"+-.0123456789":
+            operands.append(token)
+            continue
+        if not token[:1].isalpha() and token[:1] not in b"'\"":
+            continue  # скобки словарей/массивов в операндах BDC
+
+        op = token.decode("latin-1")
+        if op not in _IMAGE_ONLY_OPS:
+            return None
+        if op == "q":
+            stack.append(ctm)
+        elif op == "Q":
+            if not stack:
+                return None
+            ctm = stack.pop()
+        elif op == "cm":
+            try:
+                ctm = fitz.Matrix(*[float(x) for x in operands[-6:]]) * ctm
+            except (TypeError, ValueError):
+                return None
+        elif op == "Do":
+            if placement is not None or not operands or operands[-1][1:].decode("latin-1") != image_name:
+                return None
+            placement = ctm
+        operands = []
+
+    return placement
+
+
+def embedded_page_image(
+    doc: "fitz.Document",
+    page: "fitz.Page",
+    dpi: int = 72,
+    max_side: Optional[int] = None,
+) -> Optional[Tuple[np.ndarray, Tuple[float, float, float, float]]]:
+    """
+    Быстрый путь для сканов: если страница — это ровно одна картинка на весь
+    лист (без текста, векторной графики, аннотаций, маски и поворота),
+    декодируем её напрямую, без растеризации страницы.
+
+    Возвращает (BGR-картинка в родном разрешении, не больше max_side по длинной
+    стороне; transform в координаты рендера при dpi) или None — тогда страницу
+    надо рендерить обычным способом.
+    """
+    if page.rotation != 0 or page.first_annot is not None:
+        return None
+
+    images = page.get_images(full=True)
+    if len(images) != 1:
+        return None
+    xref, smask, _, _, _, _, _, name, _, referencer = images[0]
+    if smask != 0 or referencer != 0:  # soft-mask или картинка внутри form XObject
+        return None
+
+    m = _single_image_placement(page, name)
+    # только прямое размещение: без поворота, наклона и отражения
+    if m is None or abs(m.b) > 1e-6 or abs(m.c) > 1e-6 or m.a <= 0 or m.d <= 0:
+        return None
+
+    # единичный квадрат картинки -> координаты PDF -> координаты fitz (начало сверху слева)
+    bbox = fitz.Rect(m.e, m.f, m.e + m.a, m.f + m.d) * page.transformation_matrix
+    rect = page.rect
+    if (
+        bbox.x0 > rect.x0 + _FULL_PAGE_TOLERANCE
+        or bbox.y0 > rect.y0 + _FULL_PAGE_TOLERANCE
+        or bbox.x1 < rect.x1 - _FULL_PAGE_TOLERANCE
+        or bbox.y1 < rect.y1 - _FULL_PAGE_TOLERANCE
+    ):
+        return None
+
+    try:
+        pix = fitz.Pixmap(doc, xref)
+        if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+    except (RuntimeError, ValueError):
+        return None
+
+    image = pixmap_to_bgr(pix)
+    if max_side and max(image.shape[:2]) > max_side:
+        scale = max_side / max(image.shape[:2])
+        image = cv2.resize(
+            image,
+            (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    # пиксель картинки -> pt страницы -> пиксель рендера при dpi
+    zoom = dpi / 72.0
+    img_h, img_w = image.shape[:2]
+    transform = (
+        bbox.width / img_w * zoom,
+        bbox.height / img_h * zoom,
+        (bbox.x0 - rect.x0) * zoom,
+        (bbox.y0 - rect.y0) * zoom,
+    )
+    return image, transform
+
+
+def _load_page(
+    doc: "fitz.Document",
+    page_idx: int,
+    img_path: Optional[str],
+    dpi: int,
+    embedded_images: bool,
+    max_side: Optional[int],
+) -> PdfPage:
+    page = doc[page_idx]
+    page_num = page_idx + 1
+
+    embedded = embedded_page_image(doc, page, dpi, max_side) if embedded_images else None
+    if embedded is not None:
+        image, transform = embedded
+        # размер страницы тот же, что дал бы get_pixmap(dpi=dpi)
+        zoom = dpi / 72.0
+        irect = (page.rect * fitz.Matrix(zoom, zoom)).round()
+        page_size = (irect.width, irect.height)
+        if img_path is not None:
+            cv2.imwrite(img_path, image)
+        return PdfPage(page_num, image, img_path, page_size, transform, source="embedded")
+
+    pix = page.get_pixmap(dpi=dpi)
+    if img_path is not None:
+        pix.save(img_path)
+
+    return PdfPage(page_num, pixmap_to_bgr(pix), img_path)
+
+
+def iter_pdf_pages(
+    pdf_path: str,
+    output_dir: Optional[str] = None,
+    dpi: int = 72,
+    embedded_images: bool = False,
+    max_side: Optional[int] = None,
+    timer=NULL_TIMER,
+    page_range: Optional[Tuple[int, int]] = None,
+) -> Iterator[PdfPage]:
+    """
+    Рендерит страницы PDF и отдаёт их по одной как PdfPage (картинка в памяти).
+
+    PNG на диск пишется только если передан output_dir.
+    embedded_images — страницы-сканы (одна картинка на весь лист) не рендерятся,
+    а декодируются напрямую (см. embedded_page_image); остальные рендерятся как обычно.
+    timer — utils.timing_utils.StageTimer для стадий pdf_open и rasterize.
+    page_range — (первая, последняя) страница, нумерация с 1 включительно;
+    None — весь документ. page_num у страниц остаётся сквозным по документу.
+    """
     pdf_path = Path(pdf_path)
-    output_dir = Path(output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
+    if output_dir is not None:
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
 
-    doc = fitz.open(pdf_path)
-    pages_info = {}
+    with timer.stage("pdf_open", pages=0):
+        doc = open_pdf(pdf_path)
+    try:
+        first, last = page_range or (1, len(doc))
+        desc = f"PDF→IMG {pdf_path.name}" + (f" [{first}-{last}]" if page_range else "")
+        for page_idx in tqdm(range(first - 1, min(last, len(doc))), desc=desc):
+            img_path = None
+            if output_dir is not None:
+                img_name = f"{pdf_path.stem}_page_{page_idx + 1:04d}.png"
+                img_path = str(output_dir / img_name)
 
-    for page_idx in tqdm(range(len(doc)), desc=f"PDF→IMG {pdf_path.name}"):
-        page = doc[page_idx]
-        pix = page.get_pixmap(dpi=72)  
-        page_num = page_idx + 1
+            with timer.stage("rasterize"):
+                page = _load_page(doc, page_idx, img_path, dpi, embedded_images, max_side)
+            yield page
+    finally:
+        doc.close()
 
-        img_name = f"{pdf_path.stem}_page_{page_num:04d}.png"
-        img_path = output_dir / img_name
-        pix.save(str(img_path))
 
-        pages_info[page_num] = {
-            "image_path": str(img_path),
-            "width": pix.width,
-            "height": pix.height,
+def render_page(
+    pdf_path: str,
+    page_num: int,
+    dpi: int = 72,
+    embedded_images: bool = False,
+    max_side: Optional[int] = None,
+) -> PdfPage:
+    """Одна страница (нумерация с 1) — с теми же параметрами, что iter_pdf_pages."""
+    doc = open_pdf(pdf_path)
+    try:
+        if not 1 <= page_num <= len(doc):
+            raise IndexError(f"{Path(pdf_path).name} has no page {page_num}")
+        return _load_page(doc, page_num - 1, None, dpi, embedded_images, max_side)
+    finally:
+        doc.close()
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    doc = open_pdf(pdf_path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def split_page_range(page_count: int, parts: int, min_pages: int = 1) -> List[Tuple[int, int]]:
+    """
+    Страницы 1..page_count -> не больше parts подряд идущих диапазонов (первая, последняя)
+    почти равной длины, каждый не короче min_pages (кроме случая, когда страниц меньше).
+    """
+    if page_count <= 0:
+        return []
+    parts = max(1, min(parts, page_count // max(1, min_pages)))
+    size, extra = divmod(page_count, parts)
+
+    ranges = []
+    first = 1
+    for i in range(parts):
+        last = first + size - 1 + (1 if i < extra else 0)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def _render_range(
+    pdf_path: str,
+    page_range: Tuple[int, int],
+    output_dir: Optional[str],
+    dpi: int,
+    embedded_images: bool,
+    max_side: Optional[int],
+) -> Tuple[List[PdfPage], float]:
+    """Выполняется в процессе RenderPool: свой fitz-документ на каждый диапазон."""
+    start = time.perf_counter()
+    pages = list(iter_pdf_pages(pdf_path, output_dir, dpi, embedded_images, max_side, page_range=page_range))
+    return pages, time.perf_counter() - start
+
+
+class RenderPool:
+    """
+    Параллельная растеризация одного PDF пулом процессов.
+
+    fitz-документ нельзя делить между потоками (и PyMuPDF держит GIL),
+    поэтому PDF режется на диапазоны по chunk_pages страниц, и каждый
+    диапазон открывает и рендерит свой процесс. iter_pages отдаёт страницы
+    в исходном порядке; одновременно в работе не больше 2 * workers
+    диапазонов, так что в памяти не весь документ, а лишь окно страниц.
+    """
+
+    def __init__(self, workers: int, chunk_pages: int = 4):
+        self.workers = workers
+        self.chunk_pages = max(1, chunk_pages)
+        # spawn, а не fork: форк процесса с уже поднятыми потоками torch может зависнуть
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"))
+
+    def iter_pages(
+        self,
+        pdf_path: str,
+        output_dir: Optional[str] = None,
+        dpi: int = 72,
+        embedded_images: bool = False,
+        max_side: Optional[int] = None,
+        timer=NULL_TIMER,
+    ) -> Iterator[PdfPage]:
+        """То же, что iter_pdf_pages, но диапазоны страниц рендерятся параллельно."""
+        if output_dir is not None:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+        with timer.stage("pdf_open", pages=0):
+            page_count = pdf_page_count(pdf_path)
+        ranges = deque(
+            (first, min(first + self.chunk_pages - 1, page_count))
+            for first in range(1, page_count + 1, self.chunk_pages)
+        )
+
+        in_flight = deque()
+
+        def submit_next():
+            page_range = ranges.popleft()
+            in_flight.append(
+                self._pool.submit(
+                    _render_range, str(pdf_path), page_range, output_dir, dpi, embedded_images, max_side
+                )
+            )
+
+        try:
+            while ranges and len(in_flight) < 2 * self.workers:
+                submit_next()
+            while in_flight:
+                pages, seconds = in_flight.popleft().result()
+                if ranges:
+                    submit_next()
+                # время диапазона в процессе-рендерере, а не ожидания здесь
+                timer.record("rasterize", seconds, len(pages))
+                yield from pages
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class PageTile:
+    """
+    Тайл большого листа: image — BGR при tiling.dpi, (x0, y0) — левый верхний угол
+    в пикселях тайлов, scale — пиксель тайла -> пиксель page_size.
+    overlaps — ширина перекрытия с соседним тайлом по сторонам (left, top, right,
+    bottom), px тайла; 0 — сторона на краю листа.
+    """
+
+    def __init__(self, image: np.ndarray, x0: int, y0: int, scale: float, overlaps: Tuple[int, int, int, int]):
+        self.image = image
+        self.x0 = x0
+        self.y0 = y0
+        self.scale = scale
+        self.overlaps = overlaps
+
+    def to_page_coords(self, detections: List[Dict], edge_margin: float = 2.0) -> List[Dict]:
+        """
+        Детекции в пикселях тайла -> в координатах page_size.
+
+        Бокс у внутренней стороны отбрасывается, только если он целиком лежит в
+        полосе перекрытия — тогда соседний тайл видит объект полностью. Объект
+        крупнее перекрытия не виден целиком ни в одном тайле: такой бокс остаётся
+        с пометкой tile_cut, и куски склеиваются через шов (merge_tile_fragments).
+        """
+        h, w = self.image.shape[:2]
+        left, top, right, bottom = self.overlaps
+        mapped = []
+        for det in detections:
+            x, y, bw, bh = det["bbox"]
+            cut = (
+                (left > 0 and x <= edge_margin, x + bw <= left - edge_margin),
+                (top > 0 and y <= edge_margin, y + bh <= top - edge_margin),
+                (right > 0 and x + bw >= w - edge_margin, x >= w - right + edge_margin),
+                (bottom > 0 and y + bh >= h - edge_margin, y >= h - bottom + edge_margin),
+            )
+            if any(touches and inside for touches, inside in cut):
+                continue
+            s = self.scale
+            det = {**det, "bbox": [(x + self.x0) * s, (y + self.y0) * s, bw * s, bh * s]}
+            if any(touches for touches, _ in cut):
+                det["tile_cut"] = True
+            mapped.append(det)
+        return mapped
+
+
+def _tile_starts(length: int, tile: int, step: int) -> List[int]:
+    """Начала тайлов вдоль стороны: с шагом step, последний — вплотную к краю."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def _tile_overlaps(starts: List[int], length: int, tile: int) -> List[Tuple[int, int]]:
+    """Перекрытие каждого тайла с соседями (до, после), px; последний тайл прижат к краю и перекрывается больше."""
+    ends = [min(start + tile, length) for start in starts]
+    overlaps = []
+    for k, start in enumerate(starts):
+        before = ends[k - 1] - start if k > 0 else 0
+        after = ends[k] - starts[k + 1] if k + 1 < len(starts) else 0
+        overlaps.append((before, after))
+    return overlaps
+
+
+class PageTiles:
+    """
+    Ленивые тайлы большого листа (чертежи, планы участков).
+
+    Лист при tiling.dpi не рендерится целиком: каждый тайл — отдельный
+    get_pixmap(clip=...) со стороной tile_size и перекрытием overlap, и
+    iter_batches отдаёт их пачками по batch_size. В памяти одновременно
+    только одна пачка тайлов, сколько бы ни весил лист при этой DPI.
+    Объект хранит только путь и номер страницы — его можно передать в
+    другой процесс вместе с PdfPage (RenderPool, воркеры).
+    """
+
+    def __init__(
+        self,
+        pdf_path: str,
+        page_num: int,
+        dpi: int,
+        render_dpi: int,
+        tile_size: int = 1024,
+        overlap: float = 0.2,
+        batch_size: int = 4,
+        full_page_pass: bool = True,
+        edge_margin: float = 2.0,
+    ):
+        self.pdf_path = str(pdf_path)
+        self.page_num = page_num
+        self.dpi = dpi
+        self.render_dpi = render_dpi
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = max(1, batch_size)
+        self.full_page_pass = full_page_pass
+        self.edge_margin = edge_margin
+
+    def iter_batches(self, timer=NULL_TIMER) -> Iterator[List[PageTile]]:
+        doc = open_pdf(self.pdf_path)
+        try:
+            page = doc[self.page_num - 1]
+            rect = page.rect
+            zoom = self.dpi / 72.0
+            width, height = round(rect.width * zoom), round(rect.height * zoom)
+            tile = self.tile_size
+            step = max(1, int(tile * (1 - self.overlap)))
+            xs = _tile_starts(width, tile, step)
+            ys = _tile_starts(height, tile, step)
+            x_overlaps = _tile_overlaps(xs, width, tile)
+            y_overlaps = _tile_overlaps(ys, height, tile)
+
+            batch: List[PageTile] = []
+            for y0, (top, bottom) in zip(ys, y_overlaps):
+                for x0, (left, right) in zip(xs, x_overlaps):
+                    x1, y1 = min(x0 + tile, width), min(y0 + tile, height)
+                    clip = fitz.Rect(
+                        rect.x0 + x0 / zoom, rect.y0 + y0 / zoom, rect.x0 + x1 / zoom, rect.y0 + y1 / zoom
+                    )
+                    with timer.stage("rasterize_tile"):
+                        image = pixmap_to_bgr(page.get_pixmap(dpi=self.dpi, clip=clip))
+                    overlaps = (left, top, right, bottom)
+                    batch.append(PageTile(image, x0, y0, self.render_dpi / self.dpi, overlaps))
+                    if len(batch) >= self.batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+        finally:
+            doc.close()
+
+
+def tiling_options(cfg) -> Optional[Dict]:
+    """Секция tiling config.yaml (None — выключено)."""
+    tiling_cfg = cfg.get("tiling", {})
+    if not tiling_cfg.get("enabled", False):
+        return None
+    return {
+        "min_side_pt": tiling_cfg.get("min_side_pt", 1600),
+        "dpi": tiling_cfg.get("dpi", 150),
+        "tile_size": tiling_cfg.get("tile_size", cfg["inference"]["img_size"]),
+        "overlap": tiling_cfg.get("overlap", 0.2),
+        "batch_size": tiling_cfg.get("batch_size", cfg["inference"].get("batch_size", 1)),
+        "full_page_pass": tiling_cfg.get("full_page_pass", True),
+        "edge_margin": tiling_cfg.get("edge_margin", 2),
+    }
+
+
+def page_tiles(pdf_path: str, page: PdfPage, render_dpi: int, options: Optional[Dict]) -> Optional[PageTiles]:
+    """PageTiles, если лист больше tiling.min_side_pt (размер — по page_size при render.dpi), иначе None."""
+    if options is None:
+        return None
+    side_pt = max(page.width, page.height) * 72.0 / render_dpi
+    if side_pt < options["min_side_pt"]:
+        return None
+    params = {k: v for k, v in options.items() if k != "min_side_pt"}
+    return PageTiles(pdf_path, page.page_num, render_dpi=render_dpi, **params)
+
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    """Режет поток (например, страниц из iter_pdf_pages) на списки по batch_size."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def pdf_to_images(pdf_path: str, output_dir: str) -> Dict[int, Dict]:
+    pages_info = {}
+
+    for page in iter_pdf_pages(pdf_path, output_dir):
+        pages_info[page.page_num] = {
+            "image_path": page.image_path,
+            "width": page.width,
+            "height": page.height,
         }
 
-    doc.close()
     return pages_info
+
+
+def render_options(cfg) -> Dict:
+    """Аргументы iter_pdf_pages из секции render config.yaml (кроме output_dir)."""
+    render_cfg = cfg.get("render", {})
+    embedded_cfg = render_cfg.get("embedded_images", {})
+    return {
+        "dpi": render_cfg.get("dpi", 72),
+        "embedded_images": embedded_cfg.get("enabled", False),
+        "max_side": embedded_cfg.get("max_side"),
+    }
+
+
+def page_images_dir(cfg) -> Optional[str]:
+    """Куда сохранять PNG страниц (None — держим страницы только в памяти)."""
+    if cfg.get("render", {}).get("save_page_images", False):
+        return cfg["paths"]["page_images"]
+    return None
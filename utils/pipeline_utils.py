@@ -0,0 +1,122 @@
+import queue
+import threading
+from typing import Callable, Iterable, List, Optional
+
+# маркер конца потока в очередях
+_DONE = object()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """put с проверкой остановки: не зависаем на полной очереди, если соседняя стадия упала."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_page_pipeline(
+    pages: Iterable,
+    detect_batch: Callable[[List], List],
+    on_result: Callable,
+    batch_size: int = 1,
+    render_queue: int = 8,
+    sink_queue: int = 16,
+    sink_workers: int = 1,
+) -> None:
+    """
+    Потоковый конвейер страниц с ограниченными очередями:
+
+        pages (рендер, свой поток) -> render_q
+            -> detect_batch (пачками по batch_size, текущий поток) -> sink_q
+            -> on_result(page, detections) (sink_workers потоков: viz / запись)
+
+    Рендер идёт впереди инференса, визуализация и запись — позади него,
+    так что время прогона определяется самой медленной стадией, а не суммой.
+    Очереди ограничены (backpressure): в памяти одновременно не больше
+    render_queue + batch_size + sink_queue страниц, сколько бы их ни было в PDF.
+
+    on_result вызывается из нескольких потоков и не гарантирует порядок страниц.
+    Первая ошибка любой стадии останавливает конвейер и пробрасывается наружу.
+    """
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    render_q: queue.Queue = queue.Queue(maxsize=max(1, render_queue))
+    sink_q: queue.Queue = queue.Queue(maxsize=max(1, sink_queue))
+
+    def fail(exc: BaseException):
+        errors.append(exc)
+        stop.set()
+
+    def render():
+        try:
+            for page in pages:
+                if not _put(render_q, page, stop):
+                    return
+            _put(render_q, _DONE, stop)
+        except BaseException as exc:
+            fail(exc)
+        finally:
+            # генератор рендера закрываем в том же потоке, где он работал (fitz doc.close)
+            close: Optional[Callable] = getattr(pages, "close", None)
+            if close is not None:
+                close()
+
+    def sink():
+        while True:
+            item = _get(sink_q, stop)
+            if item is _DONE:
+                return
+            try:
+                on_result(*item)
+            except BaseException as exc:
+                fail(exc)
+                return
+
+    threads = [threading.Thread(target=render, name="pipeline-render", daemon=True)]
+    threads += [
+        threading.Thread(target=sink, name=f"pipeline-sink-{i}", daemon=True)
+        for i in range(max(1, sink_workers))
+    ]
+    for t in threads:
+        t.start()
+
+    try:
+        finished = False
+        while not finished and not stop.is_set():
+            batch = []
+            while len(batch) < batch_size:
+                item = _get(render_q, stop)
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+
+            if batch:
+                for page, detections in zip(batch, detect_batch(batch)):
+                    if not _put(sink_q, (page, detections), stop):
+                        break
+    except BaseException as exc:
+        fail(exc)
+    finally:
+        for _ in threads[1:]:
+            _put(sink_q, _DONE, stop)
+        # если стадия упала — будим остальных, чтобы они не ждали очередей
+        if errors:
+            stop.set()
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,118 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+# замер: (секунды, сколько страниц он покрывает; 0 — операция не на страницу, например открытие PDF)
+Sample = Tuple[float, int]
+
+
+class StageTimer:
+    """
+    Время по стадиям обработки: открытие PDF, рендер, predict каждой модели,
+    crop-проход, NMS, визуализация, запись JSON и т.д.
+
+    Стадия, выполненная на пачке страниц, записывается одним замером с числом
+    страниц; задержка на страницу считается как время / страницы.
+    Наблюдатели (add_observer) получают каждый замер — например, для метрик.
+    keep_samples=False — замеры только отдаются наблюдателям и не копятся
+    (для долго живущего сервиса, где summary() не нужен).
+    """
+
+    def __init__(self, keep_samples: bool = True):
+        self.keep_samples = keep_samples
+        self._lock = threading.Lock()
+        self._samples: Dict[str, List[Sample]] = {}
+        self._observers: List[Callable[[str, float, int], None]] = []
+
+    def add_observer(self, callback: Callable[[str, float, int], None]) -> None:
+        """callback(стадия, секунды, страниц) на каждый замер."""
+        self._observers.append(callback)
+
+    @contextmanager
+    def stage(self, name: str, pages: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, pages)
+
+    def record(self, name: str, seconds: float, pages: int = 1) -> None:
+        if self.keep_samples:
+            with self._lock:
+                self._samples.setdefault(name, []).append((seconds, pages))
+        for callback in self._observers:
+            callback(name, seconds, pages)
+
+    def drain(self) -> Dict[str, List[Sample]]:
+        """Забирает накопленные замеры (например, из процесса-воркера) и очищает таймер."""
+        with self._lock:
+            samples, self._samples = self._samples, {}
+        return samples
+
+    def merge(self, samples: Dict[str, List[Sample]]) -> None:
+        """Добавляет замеры другого таймера (наблюдатели видят их как свои)."""
+        for name, items in samples.items():
+            for seconds, pages in items:
+                self.record(name, seconds, pages)
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        {стадия: calls, pages, total_sec, pages_per_sec, p50_ms, p95_ms, p99_ms}
+        Перцентили — по задержке на страницу (для стадий без страниц — на вызов).
+        """
+        with self._lock:
+            samples = {name: list(items) for name, items in self._samples.items()}
+
+        result = {}
+        for name, items in samples.items():
+            seconds = np.array([s for s, _ in items], dtype=np.float64)
+            pages = np.array([p for _, p in items], dtype=np.int64)
+            weights = np.maximum(pages, 1)
+            # задержка каждой страницы пачки = время пачки / число страниц
+            per_page_ms = np.repeat(seconds / weights, weights) * 1000
+
+            total = float(seconds.sum())
+            total_pages = int(pages.sum())
+            p50, p95, p99 = np.percentile(per_page_ms, [50, 95, 99])
+            result[name] = {
+                "calls": len(items),
+                "pages": total_pages,
+                "total_sec": round(total, 4),
+                "pages_per_sec": round(total_pages / total, 2) if total > 0 and total_pages else None,
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+            }
+        return result
+
+
+class _NullTimer:
+    """Таймер-заглушка: тот же интерфейс, ничего не меряет."""
+
+    @contextmanager
+    def stage(self, name: str, pages: int = 1):
+        yield
+
+    def record(self, name: str, seconds: float, pages: int = 1) -> None:
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+def format_stage_summary(summary: Dict[str, Dict]) -> str:
+    """Таблица стадий для вывода в консоль (по убыванию суммарного времени)."""
+    lines = [
+        f"{'stage':<28}{'calls':>7}{'pages':>7}{'total s':>10}{'pages/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    ]
+    for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["total_sec"]):
+        pps = "-" if s["pages_per_sec"] is None else f"{s['pages_per_sec']:.1f}"
+        lines.append(
+            f"{name:<28}{s['calls']:>7}{s['pages']:>7}{s['total_sec']:>10.2f}{pps:>10}"
+            f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
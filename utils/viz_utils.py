@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 
 import cv2
 import numpy as np
@@ -12,27 +12,58 @@ COLOR_MAP = {
     "qr": (0, 0, 255),          # красный
 }
 
+# режимы визуализации в пакетном прогоне: все страницы / только с детекциями / не рисовать
+VIZ_MODES = ("all", "detections-only", "none")
 
-def draw_boxes(
-    image_path: str,
+# формат -> (расширение, MIME-тип)
+VIZ_FORMATS = {
+    "png": (".png", "image/png"),
+    "jpg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+
+
+def _encode_params(ext: str, quality: Optional[int]) -> List[int]:
+    if quality is None:
+        return []
+    if ext in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if ext == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    return []
+
+
+def render_overlay(
+    image: Union[str, np.ndarray],
     detections: List[Dict],
-    output_path: str,
     thickness: int = 2,
-):
+    max_side: Optional[int] = None,
+) -> np.ndarray:
     """
-    detections: список словарей
-        {
-          "category": "signature"/"stamp"/"qr",
-          "bbox": [x, y, w, h],
-          "score": 0.87
-        }
+    Картинка с нарисованными боксами (исходная не изменяется).
+
+    image: путь до картинки или страница в памяти (np.ndarray BGR)
+    detections: bbox в пикселях image
+    max_side: уменьшить так, чтобы длинная сторона была не больше (None — как есть);
+              рисуем уже на уменьшенной картинке — дешевле и подписи читаемы.
     """
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Failed to read image: {image_path}")
+    if isinstance(image, np.ndarray):
+        img = image
+    else:
+        img = cv2.imread(str(image))
+        if img is None:
+            raise ValueError(f"Failed to read image: {image}")
+
+    scale = 1.0
+    h, w = img.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        img = cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    else:
+        img = img.copy()
 
     for det in detections:
-        x, y, w, h = det["bbox"]
+        x, y, w, h = (v * scale for v in det["bbox"])
         x1, y1 = int(x), int(y)
         x2, y2 = int(x + w), int(y + h)
         category = det["category"]
@@ -57,6 +88,57 @@ def draw_boxes(
             cv2.LINE_AA,
         )
 
+    return img
+
+
+def encode_image(image: np.ndarray, fmt: str = "png", quality: Optional[int] = None) -> Tuple[bytes, str]:
+    """Кодирует картинку в png / jpg / webp в памяти. Возвращает (байты, MIME-тип)."""
+    if fmt not in VIZ_FORMATS:
+        raise ValueError(f"Unknown viz format: {fmt} (expected one of {', '.join(VIZ_FORMATS)})")
+    ext, mime = VIZ_FORMATS[fmt]
+    ok, buf = cv2.imencode(ext, image, _encode_params(ext, quality))
+    if not ok:
+        raise ValueError(f"Failed to encode image as {fmt}")
+    return buf.tobytes(), mime
+
+
+def draw_boxes(
+    image: Union[str, np.ndarray],
+    detections: List[Dict],
+    output_path: str,
+    thickness: int = 2,
+    max_side: Optional[int] = None,
+    quality: Optional[int] = None,
+):
+    """
+    image: путь до картинки или страница в памяти (np.ndarray BGR, не изменяется)
+    detections: список словарей
+        {
+          "category": "signature"/"stamp"/"qr",
+          "bbox": [x, y, w, h],
+          "score": 0.87
+        }
+    Формат файла — по расширению output_path (.png / .jpg / .webp),
+    quality — для jpg / webp, max_side — см. render_overlay.
+    """
+    img = render_overlay(image, detections, thickness, max_side)
+
     out_path = Path(output_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(out_path), img)
+    cv2.imwrite(str(out_path), img, _encode_params(out_path.suffix.lower(), quality))
+
+
+def viz_options(cfg) -> Dict:
+    """Секция viz config.yaml с умолчаниями: mode, format, quality, max_side."""
+    viz_cfg = cfg.get("viz", {})
+    options = {
+        "mode": viz_cfg.get("mode", "all"),
+        "format": viz_cfg.get("format", "png"),
+        "quality": viz_cfg.get("quality"),
+        "max_side": viz_cfg.get("max_side"),
+    }
+    if options["mode"] not in VIZ_MODES:
+        raise ValueError(f"Unknown viz mode: {options['mode']} (expected one of {', '.join(VIZ_MODES)})")
+    if options["format"] not in VIZ_FORMATS:
+        raise ValueError(f"Unknown viz format: {options['format']} (expected one of {', '.join(VIZ_FORMATS)})")
+    return options